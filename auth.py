@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+from lib import app
+
+# Loading Config Parameters
+AUTH_PUBLIC_KEY_PATH = os.getenv('AUTH_PUBLIC_KEY_PATH', 'oauth-public.key')
+AUTH_KEY_CHECK_INTERVAL = float(os.getenv('AUTH_KEY_CHECK_INTERVAL', 5))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 4096))
+
+
+class PublicKeyUnavailable(Exception):
+    """
+    The public key can't be loaded, so no token can be verified. It's a server
+    misconfiguration, not an invalid token.
+    """
+
+
+class PublicKey:
+    """
+    PublicKey.
+    RSA public key parsed once from a PEM file. The file modification time is
+    checked at most every check_interval seconds and the key is parsed again
+    when it changes, so a rotated key is used without a restart.
+
+    Attributes
+    ----------
+    path: Path of the PEM file
+    check_interval: Seconds between checks of the file
+    pem: Content of the file
+    key: Parsed public key
+    mtime: Modification time of the parsed file
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.pem = None
+        self.key = None
+        self.mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Read and parse the file
+        :return: True if the key changed
+        """
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r') as f:
+                pem = f.read()
+            self._checked_at = time.monotonic()
+            if pem == self.pem:
+                self.mtime = mtime
+                return False
+            self.key = load_pem_public_key(pem.encode('utf-8'), backend=default_backend())
+            self.pem = pem
+            self.mtime = mtime
+            return True
+
+    def get(self):
+        """
+        Get the parsed key, reloading it if the file changed
+        :return: Tuple with the key and True if it was reloaded
+        :raise PublicKeyUnavailable: If the key was never loaded and the file can't be read
+        """
+        if self.key is None:
+            try:
+                self.load()
+            except (OSError, ValueError) as e:
+                raise PublicKeyUnavailable(f"Can't load {self.path}: {e}") from e
+            return self.key, True
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self.key, False
+        try:
+            if os.stat(self.path).st_mtime == self.mtime:
+                self._checked_at = time.monotonic()
+                return self.key, False
+            reloaded = self.load()
+            return self.key, reloaded
+        except (OSError, ValueError) as e:
+            # Keep using the current key if the new file can't be read yet
+            app.logger.error(f"PublicKey -> Can't reload {self.path}: {e}")
+            self._checked_at = time.monotonic()
+            return self.key, False
+
+
+class TokenCache:
+    """
+    TokenCache.
+    Bounded LRU of the claims of already verified tokens, keyed by the sha256
+    of the token. An entry is only valid until the exp claim of its token.
+
+    Attributes
+    ----------
+    max_entries: Greatest number of entries
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        """
+        :param token: Encoded token
+        :return: Key of the token in the cache
+        """
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, digest):
+        """
+        Get the claims of a verified token
+        :param digest: Key of the token
+        :return: Claims or None if the token isn't cached or it expired
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return claims
+
+    def set(self, digest, claims):
+        """
+        Cache the claims of a verified token. Tokens without exp aren't cached
+        :param digest: Key of the token
+        :param claims: Verified claims
+        """
+        expires_at = claims.get('exp')
+        if not isinstance(expires_at, (int, float)) or time.time() >= expires_at or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = (claims, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop all the entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenVerifier:
+    """
+    TokenVerifier.
+    Verifies RS256 tokens with a PublicKey, skipping the RSA verification of
+    tokens already verified while they don't expire.
+
+    Attributes
+    ----------
+    public_key: PublicKey used to verify the tokens
+    cache: TokenCache of verified claims
+    audience: Expected aud claim
+    """
+
+    def __init__(self, public_key, cache, audience="1"):
+        self.public_key = public_key
+        self.cache = cache
+        self.audience = audience
+
+    def verify(self, token):
+        """
+        Verify a token
+        :param token: Encoded token
+        :return: Claims of the token
+        :raise jwt.InvalidTokenError: If the token isn't valid
+        :raise PublicKeyUnavailable: If the public key can't be loaded
+        """
+        key, reloaded = self.public_key.get()
+        if reloaded:
+            self.cache.clear()
+        digest = TokenCache.digest(token)
+        claims = self.cache.get(digest)
+        if claims is None:
+            claims = jwt.decode(token, key, algorithms=['RS256'], audience=self.audience)
+            self.cache.set(digest, claims)
+        return claims
+
+
+token_verifier = TokenVerifier(PublicKey(AUTH_PUBLIC_KEY_PATH, AUTH_KEY_CHECK_INTERVAL),
+                               TokenCache(AUTH_TOKEN_CACHE_SIZE))
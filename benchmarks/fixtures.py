@@ -0,0 +1,91 @@
+"""
+Data shared by the benchmarks and the load tests: a spaces catalog with every
+category and subcategory that has quantity rules, tokens and request bodies.
+"""
+import os
+import time
+
+import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = {
+    "Puestos Trabajo": ["Open Plan"],
+    "Puestos Trabajo Privado": ["Privado Pequeño", "Privado Grande"],
+    "Sala Reunión": ["Pequeña", "Mediana", "Grande"],
+    "Area Soporte": ["Recepción Pequeña (más Lounge Pequeño)", "Recepción Grande (más Lounge Grande)", "Quiet Room",
+                     "Phonebooth", "Workcoffee/Comedor Mediano", "Workcoffee/Comedor Grande",
+                     "Guardado Simple Bajo", "Guardado Simple Alto", "Locker"],
+    "Area Soporte Reuniones Informales": ["Pequeño", "Mediano", "Grande"],
+    "Area Servicios": ["Baños", "Kitchenette", "Servidor 1 Gabinete", "Servidor 2 Gabinetes", "Servidor 3 Gabinetes",
+                       "Baño Accesibilidad Universal", "Print Pequeño", "Print Grande", "Sala Lactancia", "Bodega",
+                       "Coffee point"],
+    "Especiales": ["Sala Capacitación"],
+}
+
+CAPACITIES = (5.0, 8.0, 14.0)
+USAGE_PERCENTAGES = (0.45, 0.35, 0.2)
+
+SCENARIO = {'hotdesking_level': 75, 'collaboration_level': 40, 'num_of_workers': 100}
+
+
+def build_catalog(spaces_per_subcategory=2):
+    """
+    Catalog in the format returned by the spaces module
+    :param spaces_per_subcategory: Spaces of each subcategory
+    :return: List of categories
+    """
+    categories = []
+    space_id = 1
+    subcategory_id = 1
+    for category_id, (category_name, names) in enumerate(CATEGORIES.items(), 1):
+        subcategories = []
+        for index, name in enumerate(names):
+            spaces = []
+            for _ in range(spaces_per_subcategory):
+                spaces.append({'id': space_id, 'name': f"Space {space_id}", 'subcategory_id': subcategory_id})
+                space_id += 1
+            subcategories.append({
+                'id': subcategory_id,
+                'name': name,
+                'category_id': category_id,
+                'area': 10.0,
+                'unit_area': 2.0,
+                'people_capacity': CAPACITIES[index % 3],
+                'usage_percentage': USAGE_PERCENTAGES[index % 3],
+                'spaces': spaces
+            })
+            subcategory_id += 1
+        categories.append({'id': category_id, 'name': category_name, 'subcategories': subcategories})
+    return categories
+
+
+def build_save_body(project_id, catalog, area=516.5305429864253, quantity=1):
+    """
+    Body of /api/m2/save selecting the first space of every subcategory
+    """
+    return dict(SCENARIO, project_id=project_id, area=area, workspaces=[{
+        'id': category['id'],
+        'name': category['name'],
+        'subcategories': [{
+            'id': subcategory['id'],
+            'name': subcategory['name'],
+            'observation': None,
+            'spaces': [{'id': subcategory['spaces'][0]['id'], 'quantity': quantity}]
+        } for subcategory in category['subcategories']]
+    } for category in catalog])
+
+
+def build_token(user_id=1, ttl=3600, key_path=os.path.join(ROOT, 'oauth-private.key')):
+    """
+    Bearer token signed with the development private key of the repository
+    """
+    with open(key_path, 'r') as f:
+        key = f.read()
+    now = int(time.time())
+    payload = {'aud': "1", 'sub': str(user_id), 'user_id': user_id, 'uid': user_id, 'scopes': [],
+               'iat': now, 'nbf': now, 'exp': now + ttl}
+    token = jwt.encode(payload, key, algorithm='RS256')
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    return 'Bearer ' + token
@@ -0,0 +1,55 @@
+"""
+Startup benchmark.
+Measures, in fresh interpreters, how long it takes to import main and build
+the app with create_app() (what a gunicorn worker does when it's spawned
+without preload_app), and optionally fails if the median is over a limit.
+
+    python benchmarks/startup.py --runs 10 --max 1.0
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import main
+main.create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def measure(runs):
+    """
+    Import the app in `runs` fresh interpreters
+    :param runs: Number of interpreters
+    :return: List of seconds spent importing main and calling create_app()
+    """
+    times = []
+    for _ in range(runs):
+        rv = subprocess.run([sys.executable, '-c', SCRIPT], cwd=ROOT, capture_output=True, text=True, check=True)
+        times.append(float(rv.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help="Number of fresh interpreters")
+    parser.add_argument('--max', type=float, default=None, help="Fail if the median is greater (seconds)")
+    args = parser.parse_args()
+
+    times = measure(args.runs)
+    median = statistics.median(times)
+    print(f"startup: runs={len(times)} min={min(times):.3f}s median={median:.3f}s max={max(times):.3f}s")
+    if args.max is not None and median > args.max:
+        print(f"startup: median {median:.3f}s is greater than {args.max:.3f}s")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
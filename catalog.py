@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+
+import requests
+
+from lib import app
+
+
+class CatalogEntry:
+    """
+    CatalogEntry.
+    Parsed spaces catalog with the data needed to revalidate it.
+
+    Attributes
+    ----------
+    categories: Categories, with only the subcategories that have spaces
+    etag: ETag header returned by the spaces module
+    last_modified: Last-Modified header returned by the spaces module
+    fetched_at: time.monotonic() of the last fetch or revalidation
+    """
+    __slots__ = ('categories', 'etag', 'last_modified', 'fetched_at')
+
+    def __init__(self, categories, etag, last_modified, fetched_at):
+        self.categories = categories
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+
+def copy_catalog(categories):
+    """
+    Copy only the parts of the catalog that generate_workspaces mutates:
+    the categories, subcategories and spaces dicts, and their lists
+    :param categories: Cached categories
+    :return: Categories that can be mutated by a request
+    """
+    return [dict(category, subcategories=[dict(subcategory, spaces=[dict(space) for space in subcategory['spaces']])
+                                          for subcategory in category['subcategories']])
+            for category in categories]
+
+
+class SpacesCatalogCache:
+    """
+    SpacesCatalogCache.
+    Process-local cache of the categories -> subcategories -> spaces tree of the
+    spaces module. A fresh entry is served for ttl seconds. After that, for
+    stale_ttl more seconds, the stale entry is served while it's revalidated in
+    background. Older entries are revalidated before answering, but they are
+    still served if the spaces module fails or is too slow.
+
+    Attributes
+    ----------
+    url: URL of the catalog in the spaces module
+    ttl: Seconds an entry is fresh
+    stale_ttl: Seconds an expired entry can be served while it's revalidated
+    timeout: Seconds to wait for the spaces module
+    client: Object with a requests-like get(), the requests module by default
+    """
+
+    def __init__(self, url, ttl=300.0, stale_ttl=3600.0, timeout=10.0, client=None):
+        self.url = url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.client = client or requests
+        self._entry = None
+        self._lock = threading.Lock()
+        self._revalidating = False
+
+    def get(self, token):
+        """
+        Get a copy of the catalog that the caller can mutate
+        :param token: Authorization header used to call the spaces module
+        :return: List of categories
+        """
+        entry = self._entry
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                return copy_catalog(entry.categories)
+            if age < self.ttl + self.stale_ttl:
+                self._revalidate_in_background(token)
+                return copy_catalog(entry.categories)
+
+        try:
+            entry = self.refresh(token)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if entry is None:
+                raise
+            app.logger.error(f"SpacesCatalogCache -> Serving stale catalog: {e}")
+        return copy_catalog(entry.categories)
+
+    def refresh(self, token):
+        """
+        Fetch the catalog, revalidating the current entry with ETag/If-Modified-Since
+        :param token: Authorization header used to call the spaces module
+        :return: The new (or revalidated) CatalogEntry
+        """
+        entry = self._entry
+        headers = {'Authorization': token}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        rv = self.client.get(self.url, headers=headers, timeout=self.timeout)
+        if rv.status_code == 304 and entry is not None:
+            entry = CatalogEntry(entry.categories, entry.etag, entry.last_modified, time.monotonic())
+        else:
+            rv.raise_for_status()
+            categories = json.loads(rv.text)
+            for category in categories:
+                category['subcategories'] = [subcategory for subcategory in category['subcategories']
+                                             if len(subcategory['spaces']) > 0]
+            entry = CatalogEntry(categories, rv.headers.get('ETag'), rv.headers.get('Last-Modified'),
+                                 time.monotonic())
+
+        with self._lock:
+            self._entry = entry
+        return entry
+
+    def invalidate(self):
+        """
+        Drop the cached catalog
+        """
+        with self._lock:
+            self._entry = None
+
+    def _revalidate_in_background(self, token):
+        with self._lock:
+            if self._revalidating:
+                return
+            self._revalidating = True
+
+        def revalidate():
+            try:
+                self.refresh(token)
+            except Exception as e:
+                app.logger.error(f"SpacesCatalogCache -> Can't revalidate the catalog: {e}")
+            finally:
+                with self._lock:
+                    self._revalidating = False
+
+        threading.Thread(target=revalidate, name='spaces-catalog-revalidate', daemon=True).start()
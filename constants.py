@@ -38,3 +38,97 @@ GLOBAL_CONFIG_VARS = {
     FACTOR_SOPORTE: 15.0,
     FACTOR_CIRCULACION: 35.0
 }
+
+
+############### quantity rules ##########################
+
+# Variables a quantity rule can be evaluated on
+VAR_WORKERS_NUMBER = "workers_number"
+VAR_AREA = "area"
+VAR_OBSERVATION = "observation"
+VAR_TOTAL_OPEN_PLAN = "total_open_plan"
+VAR_NUM_PRIVATE_OFFICE = "num_private_office"
+VAR_NUM_PHONEBOOTH = "num_phonebooth"
+VAR_NUM_INFORMAL_COLLABORATIVE = "num_informal_collaborative"
+
+VARIABLES = frozenset({VAR_WORKERS_NUMBER, VAR_AREA, VAR_OBSERVATION, VAR_TOTAL_OPEN_PLAN,
+                       VAR_NUM_PRIVATE_OFFICE, VAR_NUM_PHONEBOOTH, VAR_NUM_INFORMAL_COLLABORATIVE})
+
+TARGET_QUANTITY = "quantity"
+TARGET_OBSERVATION = "observation"
+TARGETS = frozenset({TARGET_QUANTITY, TARGET_OBSERVATION})
+
+
+def _rule(category, subcategory, variable, lower=None, upper=None, lower_inclusive=True, upper_inclusive=False,
+          value=0.0, factor=0.0, origin=0.0, divisor=1.0, target=TARGET_QUANTITY):
+    """
+    A band of a rule: if lower <= variable < upper (inclusiveness configurable, None is unbounded)
+    the result is value + factor * (variable - origin) / divisor. Outside every band the result is 0.
+    subcategory None applies to every subcategory of the category.
+    """
+    return {
+        'category': category,
+        'subcategory': subcategory,
+        'target': target,
+        'variable': variable,
+        'lower': lower,
+        'lower_inclusive': lower_inclusive,
+        'upper': upper,
+        'upper_inclusive': upper_inclusive,
+        'value': value,
+        'factor': factor,
+        'origin': origin,
+        'divisor': divisor
+    }
+
+
+_PUESTOS = "Puestos Trabajo"
+_PRIVADO = "Puestos Trabajo Privado"
+_SOPORTE = "Area Soporte"
+_INFORMALES = "Area Soporte Reuniones Informales"
+_SERVICIOS = "Area Servicios"
+_ESPECIALES = "Especiales"
+
+GLOBAL_QUANTITY_RULES = [
+    _rule(_PUESTOS, None, VAR_TOTAL_OPEN_PLAN, factor=1.0),
+
+    _rule(_PRIVADO, "Privado Pequeño", VAR_NUM_PRIVATE_OFFICE, factor=0.7),
+    _rule(_PRIVADO, "Privado Grande", VAR_NUM_PRIVATE_OFFICE, factor=0.3),
+
+    _rule(_SOPORTE, "Recepción Pequeña (más Lounge Pequeño)", VAR_AREA, upper=1000, upper_inclusive=True, value=1),
+    _rule(_SOPORTE, "Recepción Grande (más Lounge Grande)", VAR_AREA, lower=1000, value=1),
+    _rule(_SOPORTE, "Quiet Room", VAR_NUM_PHONEBOOTH, factor=0.5),
+    _rule(_SOPORTE, "Phonebooth", VAR_NUM_PHONEBOOTH, factor=0.5),
+    _rule(_SOPORTE, "Workcoffee/Comedor Mediano", VAR_AREA, lower=501, upper=1500, upper_inclusive=True, value=1),
+    _rule(_SOPORTE, "Workcoffee/Comedor Grande", VAR_AREA, lower=1202, value=1),
+    _rule(_SOPORTE, "Guardado Simple Bajo", VAR_AREA),
+    _rule(_SOPORTE, "Guardado Simple Alto", VAR_AREA),
+    _rule(_SOPORTE, "Locker", VAR_AREA),
+
+    _rule(_INFORMALES, "Pequeño", VAR_NUM_INFORMAL_COLLABORATIVE, factor=0.2, target=TARGET_OBSERVATION),
+    _rule(_INFORMALES, "Mediano", VAR_NUM_INFORMAL_COLLABORATIVE, factor=0.3, target=TARGET_OBSERVATION),
+    _rule(_INFORMALES, "Grande", VAR_NUM_INFORMAL_COLLABORATIVE, factor=0.5, target=TARGET_OBSERVATION),
+    _rule(_INFORMALES, "Pequeño", VAR_OBSERVATION, factor=1.0, divisor=4),
+    _rule(_INFORMALES, "Mediano", VAR_OBSERVATION, factor=1.0, divisor=9),
+    _rule(_INFORMALES, "Grande", VAR_OBSERVATION, factor=1.0, divisor=13),
+
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, upper=11, value=1),
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, lower=11, upper=31, value=2),
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, lower=31, upper=51, value=3),
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, lower=51, upper=71, value=4),
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, lower=71, upper=91, value=5),
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, lower=91, upper=101, value=6),
+    _rule(_SERVICIOS, "Baños", VAR_WORKERS_NUMBER, lower=101, value=6, factor=1.0, origin=100, divisor=15),
+    _rule(_SERVICIOS, "Kitchenette", VAR_AREA, upper=500, value=1),
+    _rule(_SERVICIOS, "Servidor 1 Gabinete", VAR_AREA, upper=500, value=1),
+    _rule(_SERVICIOS, "Servidor 2 Gabinetes", VAR_AREA, lower=501, upper=1500, upper_inclusive=True, value=1),
+    _rule(_SERVICIOS, "Servidor 3 Gabinetes", VAR_AREA, lower=1501, lower_inclusive=False, value=1),
+    _rule(_SERVICIOS, "Baño Accesibilidad Universal", VAR_AREA, lower=500, lower_inclusive=False, value=1),
+    _rule(_SERVICIOS, "Print Pequeño", VAR_AREA, value=1, factor=1.0, divisor=600),
+    _rule(_SERVICIOS, "Print Grande", VAR_AREA, factor=1.0, divisor=1200),
+    _rule(_SERVICIOS, "Sala Lactancia", VAR_AREA),
+    _rule(_SERVICIOS, "Bodega", VAR_AREA),
+    _rule(_SERVICIOS, "Coffee point", VAR_AREA),
+
+    _rule(_ESPECIALES, None, VAR_AREA),
+]
@@ -0,0 +1,78 @@
+"""
+Production gunicorn settings: gunicorn -c gunicorn.conf.py "main:create_app()"
+
+The app is preloaded in the master and the workers are forked from it. Every
+worker resets the database and HTTP pools inherited from the master in post_fork.
+"""
+import multiprocessing
+import os
+import tempfile
+
+# Shared by the workers to aggregate /api/m2/metrics, set before the app is preloaded
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'm2-metrics'))
+
+
+def cpu_count():
+    """
+    CPUs available to the container: the cgroup CPU quota if there's one,
+    else the CPUs the process can run on
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+CPUS = cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8082')
+
+# gthread (default), gevent (needs `pip install gevent`) or sync
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # The app is preloaded, so the standard library must be patched before it's imported
+    from gevent import monkey
+    monkey.patch_all()
+
+if worker_class == 'sync':
+    workers = int(os.getenv('GUNICORN_WORKERS', 2 * CPUS + 1))
+else:
+    # The threads (or greenlets) of each worker wait for the other modules concurrently
+    workers = int(os.getenv('GUNICORN_WORKERS', CPUS + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+
+def on_starting(server):
+    from metrics import clear_directory
+    clear_directory(os.environ['METRICS_DIR'])
+
+
+def post_fork(server, worker):
+    from main import reset_after_fork
+    reset_after_fork()
+
+
+def worker_exit(server, worker):
+    from metrics import registry
+    registry.flush()
+
+
+def child_exit(server, worker):
+    from metrics import registry
+    registry.retire(worker.pid)
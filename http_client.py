@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import observe_outbound
+
+# Loading Config Parameters
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 2))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.2))
+HTTP_MAX_CONCURRENT_CALLS = int(os.getenv('HTTP_MAX_CONCURRENT_CALLS', 8))
+
+
+class CallStats:
+    """
+    CallStats.
+    Latency stats of the calls made to a service.
+
+    Attributes
+    ----------
+    count: Number of calls
+    errors: Number of calls that raised an exception or returned a 5xx status
+    total_time: Sum of the latencies in seconds
+    max_time: Greatest latency in seconds
+    """
+    __slots__ = ('count', 'errors', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def to_dict(self):
+        """
+        Convert to dictionary
+        """
+
+        dict = {
+            'count': self.count,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time
+        }
+        return dict
+
+
+class ServiceClient:
+    """
+    ServiceClient.
+    Pooled keep-alive HTTP client to call another module. The connections are
+    reused across requests, every call has connect/read timeouts, and failed
+    connections and 502/503/504 responses are retried with backoff.
+    The connection pool (adapter) is created per process, so each gunicorn
+    worker has its own pool, and each thread (or greenlet) uses its own
+    session on top of it, since a requests.Session isn't thread-safe.
+
+    Attributes
+    ----------
+    name: Name of the service, used in the stats
+    pool_size: Max connections kept alive
+    timeout: Tuple (connect timeout, read timeout) in seconds
+    retries: Max retries of a call
+    backoff_factor: Backoff factor between retries
+    """
+
+    def __init__(self, name, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+        self.name = name
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._adapter = None
+        self._local = threading.local()
+        self._pid = None
+        self._stats = CallStats()
+
+    def _build_adapter(self):
+        retry = Retry(total=self.retries,
+                      backoff_factor=self.backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'PUT', 'HEAD', 'OPTIONS']),
+                      raise_on_status=False)
+        return HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+
+    @property
+    def adapter(self):
+        pid = os.getpid()
+        if self._adapter is None or self._pid != pid:
+            with self._lock:
+                if self._adapter is None or self._pid != pid:
+                    self._adapter = self._build_adapter()
+                    self._local = threading.local()
+                    self._pid = pid
+                    self._stats = CallStats()
+        return self._adapter
+
+    @property
+    def session(self):
+        adapter = self.adapter
+        local = self._local
+        session = getattr(local, 'session', None)
+        if session is None or session.adapters['http://'] is not adapter:
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Call the service, recording its latency
+        :return: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.session
+        start = time.perf_counter()
+        failed = True
+        try:
+            rv = session.request(method, url, **kwargs)
+            failed = rv.status_code >= 500
+            return rv
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._stats
+                stats.count += 1
+                stats.errors += failed
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+            observe_outbound(self.name, elapsed, failed)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def stats(self):
+        """
+        Get the latency stats of this worker
+        :return: dict
+        """
+        with self._lock:
+            return self._stats.to_dict()
+
+    def close(self):
+        """
+        Close the pooled connections
+        """
+        with self._lock:
+            if self._adapter is not None and self._pid == os.getpid():
+                self._adapter.close()
+            self._adapter = None
+            self._local = threading.local()
+            self._pid = None
+
+    def reset(self):
+        """
+        Forget the pool inherited from the parent process after a fork,
+        without closing its connections, which still belong to the parent
+        """
+        # The lock could have been held by a thread that doesn't exist in the child
+        self._lock = threading.Lock()
+        self._adapter = None
+        self._local = threading.local()
+        self._pid = None
+        self._stats = CallStats()
+
+
+_executor_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+def outbound_executor():
+    """
+    Get the thread pool of this process used to overlap the calls to other
+    modules with the local work of a request
+    :return: ThreadPoolExecutor
+    """
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=HTTP_MAX_CONCURRENT_CALLS,
+                                               thread_name_prefix='outbound')
+                _executor_pid = pid
+    return _executor
+
+
+def reset_outbound_executor():
+    """
+    Forget the thread pool inherited from the parent process after a fork.
+    Its threads don't exist in the child, a new pool is created on first use.
+    """
+    global _executor, _executor_lock, _executor_pid
+
+    _executor_lock = threading.Lock()
+    _executor = None
+    _executor_pid = None
+
+
+def submit_outbound(fn, *args, **kwargs):
+    """
+    Run a call to another module in the outbound thread pool, in a copy of the
+    current context, so its time is added to the request that made it
+    :return: Future
+    """
+    return outbound_executor().submit(copy_context().run, fn, *args, **kwargs)
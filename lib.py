@@ -1,7 +1,18 @@
-from flask import Flask, jsonify, abort, request
+from flask import Flask, abort, request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from json_provider import json_response
 import constants
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+import numpy as np
 
 import os
 
@@ -11,18 +22,124 @@ DB_PASS = os.getenv('DB_PASSWORD', 'rac3e/07')
 DB_IP = os.getenv('DB_IP_ADDRESS', '10.2.19.195')
 DB_PORT = os.getenv('DB_PORT', '3307')
 DB_SCHEMA = os.getenv('DB_SCHEMA', 'wys')
+# Full SQLAlchemy URI, overrides the DB_* variables above (e.g. sqlite:////tmp/m2.db)
+DB_URI = os.getenv('DB_URI', f"mysql://{DB_USER}:{DB_PASS}@{DB_IP}:{DB_PORT}/{DB_SCHEMA}")
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+CONFIG_VERSION_CHECK_INTERVAL = float(os.getenv('CONFIG_VERSION_CHECK_INTERVAL', 5))
+CONFIG_SNAPSHOT_CACHE_SIZE = int(os.getenv('CONFIG_SNAPSHOT_CACHE_SIZE', 16))
+
+# Range of inputs covered by the compiled area coefficients
+MIN_HOTDESKING = 70
+MAX_HOTDESKING = 100
+MIN_COLLABORATION = 30
+MAX_COLLABORATION = 50
+
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    InstrumentedQueuePool.
+    QueuePool that records how long it takes to check out a connection
+    (waiting for a free one, opening a new one and the pre ping).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.total_wait += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+
+    def stats(self):
+        """
+        Get the live state of the pool and its checkout times
+        :return: dict
+        """
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_in': self.checkedin(),
+                'checked_out': self.checkedout(),
+                'overflow': self.overflow(),
+                'max_overflow': self._max_overflow,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'total_wait': self.total_wait,
+                'avg_wait': self.total_wait / self.checkouts if self.checkouts else 0.0,
+                'max_wait': self.max_wait
+            }
+
+
+# Options of the connection pool, only applied to server databases (MySQL)
+POOL_OPTIONS = {
+    'poolclass': InstrumentedQueuePool,
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+    'pool_timeout': DB_POOL_TIMEOUT
+}
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy that applies POOL_OPTIONS to every database but SQLite, which
+    keeps the pool chosen by Flask-SQLAlchemy. SQLALCHEMY_ENGINE_OPTIONS
+    still overrides them.
+    """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        if not sa_url.drivername.startswith('sqlite'):
+            options.update(POOL_OPTIONS)
+        return sa_url, options
+
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql://{DB_USER}:{DB_PASS}@{DB_IP}:{DB_PORT}/{DB_SCHEMA}"
+app.config['SQLALCHEMY_DATABASE_URI'] = DB_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.logger.setLevel(logging.DEBUG)
-db = SQLAlchemy(app)
+db = PooledSQLAlchemy(app)
+
+
+def pool_stats():
+    """
+    Get the stats of the database connection pool of this worker
+    :return: dict, with only the class of the pool if it isn't instrumented
+    """
+    pool = db.engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {'class': type(pool).__name__}
 
 class M2InternalConfigVar(db.Model):
     """
     M2InternalConfigVar.
     Represent a configuration variable that are used to calc the final area.
 
+    It's the current (mutable) version of the variables, every version is
+    also kept in M2InternalConfigVarHistory.
+
     Attributes
     ----------
     id: Represent the unique id of a Internal SubCategory
@@ -30,7 +147,7 @@ class M2InternalConfigVar(db.Model):
     value: Value of the variable
     """
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120))
+    name = db.Column(db.String(120), unique=True, index=True)
     value = db.Column(db.Float)
 
     def to_dict(self):
@@ -49,36 +166,462 @@ class M2InternalConfigVar(db.Model):
         """
         Serialize to json
         """
-        return jsonify(self.to_dict())
+        return json_response(self.to_dict())
+
+
+class M2InternalConfigVarHistory(db.Model):
+    """
+    M2InternalConfigVarHistory.
+    Immutable copy of a configuration variable in a config version. A full set
+    of variables is written every time the config version is bumped.
+
+    Attributes
+    ----------
+    id: Represent the unique id of the row
+    version: Config version of the set
+    var_id: ID of the M2InternalConfigVar
+    name: Name of the variable
+    value: Value of the variable in the version
+    """
+    __table_args__ = (db.UniqueConstraint('version', 'name'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    var_id = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(120), nullable=False)
+    value = db.Column(db.Float)
+
+    def to_dict(self):
+        """
+        Convert to dictionary
+        """
+
+        dict = {
+            'id': self.var_id,
+            'name': self.name,
+            'value': self.value,
+            'version': self.version
+        }
+        return dict
+
+
+class M2QuantityRule(db.Model):
+    """
+    M2QuantityRule.
+    Represent a band of the rule used to calc the quantity (or observation) of
+    the spaces of a subcategory. If the variable is in [lower, upper) (the
+    inclusiveness of each limit is configurable, null is unbounded), the result
+    is value + factor * (variable - origin) / divisor. Outside of every band of
+    the rule the result is 0.
+
+    Attributes
+    ----------
+    id: Represent the unique id of a band
+    category: Name of the category
+    subcategory: Name of the subcategory, null applies to every subcategory of the category
+    target: What is calculated, quantity or observation
+    variable: Name of the variable the band is evaluated on
+    lower: Lower limit of the band
+    lower_inclusive: If the lower limit belongs to the band
+    upper: Upper limit of the band
+    upper_inclusive: If the upper limit belongs to the band
+    value: Constant term of the result
+    factor: Factor of the variable in the result
+    origin: Value subtracted to the variable in the result
+    divisor: Divisor of the variable term in the result
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(120), nullable=False)
+    subcategory = db.Column(db.String(120))
+    target = db.Column(db.String(20), nullable=False, default=constants.TARGET_QUANTITY)
+    variable = db.Column(db.String(40), nullable=False)
+    lower = db.Column(db.Float)
+    lower_inclusive = db.Column(db.Boolean, nullable=False, default=True)
+    upper = db.Column(db.Float)
+    upper_inclusive = db.Column(db.Boolean, nullable=False, default=False)
+    value = db.Column(db.Float, nullable=False, default=0.0)
+    factor = db.Column(db.Float, nullable=False, default=0.0)
+    origin = db.Column(db.Float, nullable=False, default=0.0)
+    divisor = db.Column(db.Float, nullable=False, default=1.0)
+
+    def to_dict(self):
+        """
+        Convert to dictionary
+        """
+
+        dict = {
+            'id': self.id,
+            'category': self.category,
+            'subcategory': self.subcategory,
+            'target': self.target,
+            'variable': self.variable,
+            'lower': self.lower,
+            'lower_inclusive': self.lower_inclusive,
+            'upper': self.upper,
+            'upper_inclusive': self.upper_inclusive,
+            'value': self.value,
+            'factor': self.factor,
+            'origin': self.origin,
+            'divisor': self.divisor
+        }
+        return dict
+
+    def serialize(self):
+        """
+        Serialize to json
+        """
+        return json_response(self.to_dict())
+
+
+class ConfigSnapshot:
+    """
+    ConfigSnapshot.
+    Immutable view of every M2InternalConfigVar (loaded in a single query) and
+    M2QuantityRule, shared by all the m2_* functions and the quantity rules.
+
+    Attributes
+    ----------
+    version: Version of the set of config vars the snapshot was loaded from
+    revision: Shared reload revision the snapshot was loaded at, None for older versions
+    values: Read-only mapping of variable name -> value
+    digest: Fingerprint of the values
+    quantity_rules: Tuple with the dict of every M2QuantityRule
+    area_coefficients: Total area per worker of every (hotdesking, collaboration)
+        pair in range, compiled from the values. None if they can't be compiled.
+    """
+    __slots__ = ('version', 'revision', 'values', 'digest', 'quantity_rules', 'area_coefficients', '_area_coefficients_list')
+
+    def __init__(self, version, values, quantity_rules=(), revision=None):
+        self.version = version
+        self.revision = revision
+        self.values = MappingProxyType(dict(values))
+        self.quantity_rules = tuple(MappingProxyType(dict(rule)) for rule in quantity_rules)
+        items = sorted((str(name), repr(value)) for name, value in self.values.items())
+        self.digest = hashlib.sha256(repr(items).encode('utf-8')).digest()[:16]
+        self.area_coefficients = None
+        self._area_coefficients_list = None
+        try:
+            self.area_coefficients = compile_area_coefficients(self)
+            self._area_coefficients_list = self.area_coefficients.tolist()
+        except Exception as e:
+            app.logger.warning(f"ConfigSnapshot -> Can't compile area coefficients: {e}")
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def area_coefficient(self, hotdesking, grade_of_collaboration):
+        """
+        Get the compiled total area per worker
+        :param hotdesking: Integer number between 70 and 100
+        :param grade_of_collaboration: Integer between 30 and 50
+        :return: The area per worker, None if the inputs are out of the compiled range
+        """
+        if self._area_coefficients_list is None:
+            return None
+        try:
+            hd_index = int(hotdesking)
+            gc_index = int(grade_of_collaboration)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if hd_index != hotdesking or gc_index != grade_of_collaboration:
+            return None
+        if not (MIN_HOTDESKING <= hd_index <= MAX_HOTDESKING and
+                MIN_COLLABORATION <= gc_index <= MAX_COLLABORATION):
+            return None
+        return self._area_coefficients_list[hd_index - MIN_HOTDESKING][gc_index - MIN_COLLABORATION]
+
+
+class M2ConfigVersion(db.Model):
+    """
+    M2ConfigVersion.
+    Single row shared by every worker. It's bumped in the same transaction
+    that changes the config vars or the quantity rules, so workers know when
+    to reload them. The version of the config vars is the latest one of
+    M2InternalConfigVarHistory.
+
+    Attributes
+    ----------
+    id: Represent the unique id of the row (always 1)
+    version: Current reload revision of the config vars and quantity rules
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+
+CONFIG_VERSION_ID = 1
+
+_config_lock = threading.Lock()
+_config_snapshot = None
+_config_checked_at = 0.0
+# Snapshots of the latest used versions, by version
+_config_snapshots = OrderedDict()
+# Snapshot pinned by pinned_config()
+_pinned_config = ContextVar('m2_pinned_config', default=None)
+
+
+def current_config_revision():
+    """
+    Read the shared reload revision
+    :return: The revision number, 0 if it was never set
+    """
+    revision = db.session \
+        .query(M2ConfigVersion.version) \
+        .filter_by(id=CONFIG_VERSION_ID) \
+        .scalar()
+    return revision or 0
+
+
+def bump_config_revision():
+    """
+    Increment the shared reload revision, so every worker reloads the config
+    vars and quantity rules. It doesn't commit, so it must be called in the
+    same transaction that changes them.
+    :return: The new revision number
+    """
+    updated = db.session \
+        .query(M2ConfigVersion) \
+        .filter_by(id=CONFIG_VERSION_ID) \
+        .update({M2ConfigVersion.version: M2ConfigVersion.version + 1},
+                synchronize_session=False)
+    if not updated:
+        db.session.add(M2ConfigVersion(id=CONFIG_VERSION_ID, version=1))
+    db.session.flush()
+    return current_config_revision()
+
+
+def current_config_version():
+    """
+    Read the version of the current config vars
+    :return: The latest version with a set of config vars, 0 if there isn't
+    """
+    version = db.session \
+        .query(db.func.max(M2InternalConfigVarHistory.version)) \
+        .scalar()
+    return version or 0
+
+
+def bump_config_version():
+    """
+    Save the current config vars as the immutable set of a new version and
+    bump the reload revision. If they are the same as the latest set, nothing
+    is saved. It doesn't commit, so it must be called in the same transaction
+    that changes the config vars. Two concurrent calls can't save the same
+    version, the second one fails on the unique (version, name).
+    :return: The version number of the current config vars
+    """
+    version = current_config_version()
+    if version:
+        head = db.session \
+            .query(M2InternalConfigVar.name, M2InternalConfigVar.value) \
+            .all()
+        latest = db.session \
+            .query(M2InternalConfigVarHistory.name, M2InternalConfigVarHistory.value) \
+            .filter_by(version=version) \
+            .all()
+        if dict(head) == dict(latest):
+            return version
+    bump_config_revision()
+    save_config_history(version + 1)
+    return version + 1
+
+
+def save_config_history(version):
+    """
+    Copy the current config vars to the set of a version, in one statement.
+    It doesn't commit.
+    :param version: Config version of the set
+    """
+    head = M2InternalConfigVar.__table__
+    history = M2InternalConfigVarHistory.__table__
+    db.session.execute(
+        history.insert().from_select(
+            ['version', 'var_id', 'name', 'value'],
+            db.select(db.literal(version), head.c.id, head.c.name, head.c.value)))
+
+
+def config_versions():
+    """
+    :return: Sorted list of the versions that have a set of config vars
+    """
+    rows = db.session \
+        .query(M2InternalConfigVarHistory.version) \
+        .distinct() \
+        .order_by(M2InternalConfigVarHistory.version) \
+        .all()
+    return [version for version, in rows]
+
+
+def config_history(version):
+    """
+    Get the set of config vars of a version
+    :param version: Config version
+    :return: List of M2InternalConfigVarHistory, empty if the version doesn't exist
+    """
+    return M2InternalConfigVarHistory.query \
+        .filter_by(version=version) \
+        .order_by(M2InternalConfigVarHistory.var_id) \
+        .all()
+
+
+def _cache_snapshot(snapshot):
+    """
+    Keep a snapshot in the per version LRU. It must be called with _config_lock
+    """
+    _config_snapshots[snapshot.version] = snapshot
+    _config_snapshots.move_to_end(snapshot.version)
+    while len(_config_snapshots) > max(CONFIG_SNAPSHOT_CACHE_SIZE, 1):
+        _config_snapshots.popitem(last=False)
+
+
+def reload_config():
+    """
+    Load all config vars in one query and atomically swap the shared snapshot
+    :return: The new ConfigSnapshot
+    """
+    global _config_snapshot, _config_checked_at
+
+    revision = current_config_revision()
+    version = current_config_version()
+    rows = db.session \
+        .query(M2InternalConfigVar.name, M2InternalConfigVar.value) \
+        .all()
+    quantity_rules = [rule.to_dict() for rule in M2QuantityRule.query.all()]
+
+    with _config_lock:
+        snapshot = ConfigSnapshot(version, rows, quantity_rules, revision)
+        _config_snapshot = snapshot
+        _config_checked_at = time.monotonic()
+        _cache_snapshot(snapshot)
+    return snapshot
+
+
+def get_config_version(version):
+    """
+    Get the snapshot of a config version. The sets are immutable, so each one
+    is loaded once and kept in a LRU of CONFIG_SNAPSHOT_CACHE_SIZE versions.
+    The quantity rules aren't versioned, the snapshot keeps the ones current
+    when it was loaded (the pinned snapshots are only used to calc the area).
+    :param version: Config version
+    :return: ConfigSnapshot, or None if the version doesn't exist
+    """
+    current = get_config()
+    if current.version == version:
+        return current
+    with _config_lock:
+        snapshot = _config_snapshots.get(version)
+        if snapshot is not None:
+            _config_snapshots.move_to_end(version)
+            return snapshot
+
+    rows = db.session \
+        .query(M2InternalConfigVarHistory.name, M2InternalConfigVarHistory.value) \
+        .filter_by(version=version) \
+        .all()
+    if not rows:
+        return None
+    snapshot = ConfigSnapshot(version, rows, current.quantity_rules)
+    with _config_lock:
+        _cache_snapshot(snapshot)
+    return snapshot
+
+
+@contextmanager
+def pinned_config(snapshot):
+    """
+    Make get_config() return the given snapshot in the current context, so the
+    m2_* functions compute with the config vars of another version
+    :param snapshot: ConfigSnapshot
+    """
+    token = _pinned_config.set(snapshot)
+    try:
+        yield snapshot
+    finally:
+        _pinned_config.reset(token)
+
+
+def invalidate_config():
+    """
+    Drop the shared snapshot and the cached versions, the next get_config()
+    call reloads it
+    """
+    global _config_snapshot
+    with _config_lock:
+        _config_snapshot = None
+        _config_snapshots.clear()
+
+
+def get_config():
+    """
+    Get the current config snapshot. At most once every
+    CONFIG_VERSION_CHECK_INTERVAL seconds the shared reload revision is checked,
+    and the config vars and quantity rules are reloaded only if it changed.
+    Inside pinned_config() the pinned snapshot is returned instead.
+    :return: ConfigSnapshot
+    """
+    global _config_checked_at
+
+    snapshot = _pinned_config.get()
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = _config_snapshot
+    if snapshot is None:
+        return reload_config()
+
+    now = time.monotonic()
+    if now - _config_checked_at >= CONFIG_VERSION_CHECK_INTERVAL:
+        _config_checked_at = now
+        if current_config_revision() != snapshot.revision:
+            snapshot = reload_config()
+    return snapshot
 
-db.create_all()  # Create all tables
 
 def load_config_vars():
     """
-    Load all config vars by default defined in constants.py
-    If variable exist, don't change
+    Load all config vars and quantity rules by default defined in constants.py
+    If variables (or rules) exist, don't change them. If there isn't any set
+    of config vars (e.g. a database created before they were versioned), the
+    current ones are saved as a new version.
     """
 
-    total_rows = db.session \
+    total_vars = db.session \
         .query(M2InternalConfigVar) \
         .count()
-
-    # If there are variables in database, do nothing
-    if total_rows > 0:
-        return
-
-    # Else put the variables by defect
+    total_rules = db.session \
+        .query(M2QuantityRule) \
+        .count()
 
     try:
-        for k, v in constants.GLOBAL_CONFIG_VARS.items():
-            db.session.add(M2InternalConfigVar(name=k, value=v))
+        # If there are variables and rules in database, only check the set of the current version
+        if total_vars > 0 and total_rules > 0:
+            if current_config_version() == 0:
+                bump_config_version()
+            else:
+                return
+        # Else put the ones by defect
+        else:
+            if total_vars == 0:
+                for k, v in constants.GLOBAL_CONFIG_VARS.items():
+                    db.session.add(M2InternalConfigVar(name=k, value=v))
+            if total_rules == 0:
+                for rule in constants.GLOBAL_QUANTITY_RULES:
+                    db.session.add(M2QuantityRule(**rule))
+            db.session.flush()
+            bump_config_version()
         db.session.commit()
+        invalidate_config()
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"load_config_vars -> {e}")
 
 
-load_config_vars()
+def init_db():
+    """
+    Create the tables that don't exist and load the default config vars and
+    quantity rules. It's run by `flask init-db`, not when the app is imported.
+    """
+    db.create_all()
+    load_config_vars()
 
 
 def m2_open_plan(hotdesking, workers_number):
@@ -89,10 +632,7 @@ def m2_open_plan(hotdesking, workers_number):
     :return: area in m2 for open plan spaces
     """
     try:
-        op_density = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_PUESTO_TRABAJO_OPEN) \
-            .first() \
-            .value
+        op_density = get_config()[constants.DEN_PUESTO_TRABAJO_OPEN]
         m2 = total_open_plan(hotdesking, workers_number) * float(op_density)
         return m2
 
@@ -109,10 +649,7 @@ def total_open_plan(hotdesking, workers_number):
     :return: Total Open Plan Desks
     """
     try:
-        open_plan_factor = M2InternalConfigVar.query \
-            .filter_by(name=constants.FACTOR_OPEN_PLAN) \
-            .first() \
-            .value
+        open_plan_factor = get_config()[constants.FACTOR_OPEN_PLAN]
         return open_plan_factor * total_individual_spaces(hotdesking, workers_number)
     except Exception as e:
         app.logger.error(f"calc_total_open_plan -> Message: {e}")
@@ -165,10 +702,7 @@ def m2_private_office(hotdesking, workers_number):
     :return: The total area used by private offices
     """
     try:
-        po_density = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_OFICINA_PRIVADA) \
-            .first() \
-            .value
+        po_density = get_config()[constants.DEN_OFICINA_PRIVADA]
 
         return po_density * num_private_office(hotdesking, workers_number)
 
@@ -186,10 +720,7 @@ def factor_phonebooth(hotdesking):
     """
     try:
         po_factor = factor_private_office(hotdesking)
-        op_factor = M2InternalConfigVar.query \
-            .filter_by(name=constants.FACTOR_OPEN_PLAN) \
-            .first() \
-            .value
+        op_factor = get_config()[constants.FACTOR_OPEN_PLAN]
         return 1 - po_factor - op_factor
     except Exception as e:
         app.logger.error(f"factor_phonebooth -> Message: {e}")
@@ -220,10 +751,7 @@ def m2_phonebooth(hotdesking, workers_number):
     :return: Total phonebooth area.
     """
     try:
-        pb_density = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_PHONEBOOTH) \
-            .first() \
-            .value
+        pb_density = get_config()[constants.DEN_PHONEBOOTH]
         return num_phonebooth(hotdesking, workers_number) * pb_density
     except Exception as e:
         app.logger.error(f"m2_phonebooth -> Message: {e}")
@@ -281,10 +809,7 @@ def m2_informal_collaborative(hotdesking, grade_of_collaboration, workers_number
     """
     num_inf_col = num_informal_collaborative(hotdesking, grade_of_collaboration, workers_number)
     try:
-        ic_density = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_COLABORATIVO_INFORMAL) \
-            .first() \
-            .value
+        ic_density = get_config()[constants.DEN_COLABORATIVO_INFORMAL]
         return num_inf_col * ic_density
 
     except Exception as e:
@@ -314,10 +839,7 @@ def m2_formal_collaborative(hotdesking, grade_of_collaboration, workers_number):
     :return: total area of formal collaboratives spaces
     """
     try:
-        den_col_form = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_COLABORATIVO_FORMAL) \
-            .first() \
-            .value
+        den_col_form = get_config()[constants.DEN_COLABORATIVO_FORMAL]
         return den_col_form * num_formal_collaborative(hotdesking, grade_of_collaboration, workers_number)
     except Exception as e:
         app.logger.error(f"m2_informal_collaborative -> Message: {e}")
@@ -334,10 +856,7 @@ def m2_support(hotdesking, workers_number):
     try:
         private_office = m2_private_office(hotdesking, workers_number)
         open_plan = m2_open_plan(hotdesking, workers_number)
-        den_support = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_SOPORTE) \
-            .first() \
-            .value
+        den_support = get_config()[constants.DEN_SOPORTE]
         use_percent = den_support / (100.0 - den_support)
         return (private_office + open_plan) * use_percent
 
@@ -356,10 +875,7 @@ def m2_circulations(hotdesking, workers_number):
     try:
         private_office = m2_private_office(hotdesking, workers_number)
         open_plan = m2_open_plan(hotdesking, workers_number)
-        den_circ = M2InternalConfigVar.query \
-            .filter_by(name=constants.DEN_CIRCULACIONES) \
-            .first() \
-            .value
+        den_circ = get_config()[constants.DEN_CIRCULACIONES]
         use_percent = den_circ / (100.0 - den_circ)
     except Exception as e:
         app.logger.error(f"m2_circulations -> Message: {e}")
@@ -368,6 +884,77 @@ def m2_circulations(hotdesking, workers_number):
     return (private_office + open_plan + m2_support(hotdesking, workers_number)) * use_percent
 
 
+def quantity_intermediates(hotdesking, grade_of_collaboration, workers_number):
+    """
+    Calc the number of spaces of each kind used to generate the workspaces quantities
+    :param hotdesking: Integer number between 70 and 100
+    :param grade_of_collaboration: Integer between 30 and 50
+    :param workers_number: Integer number between 0 to 1000
+    :return: dict with total_open_plan, num_private_office, num_phonebooth,
+             num_formal_collaborative and num_informal_collaborative
+    """
+    return {
+        'total_open_plan': total_open_plan(hotdesking, workers_number),
+        'num_private_office': num_private_office(hotdesking, workers_number),
+        'num_phonebooth': num_phonebooth(hotdesking, workers_number),
+        'num_formal_collaborative': num_formal_collaborative(hotdesking, grade_of_collaboration, workers_number),
+        'num_informal_collaborative': num_informal_collaborative(hotdesking, grade_of_collaboration, workers_number)
+    }
+
+
+def area_breakdown(hotdesking, grade_of_collaboration, workers_number):
+    """
+    Calc the area of every kind of space in a single pass, evaluating each
+    intermediate value only once. The results are the same as the ones of
+    the respective m2_* functions.
+    :param hotdesking: Integer number between 70 and 100
+    :param grade_of_collaboration: Integer between 30 and 50
+    :param workers_number: workers_number: Integer number between 0 to 1000
+    :return: dict with the area of each kind of space and the total area
+    """
+    try:
+        config = get_config()
+        individual_spaces = total_individual_spaces(hotdesking, workers_number)
+        po_factor = factor_private_office(hotdesking)
+        op_factor = config[constants.FACTOR_OPEN_PLAN]
+        fc_factor = factor_formal_collaborative(grade_of_collaboration)
+        collaborative = (grade_of_collaboration * individual_spaces * 1.0) / (100.0 - grade_of_collaboration)
+
+        open_plan = op_factor * individual_spaces * float(config[constants.DEN_PUESTO_TRABAJO_OPEN])
+        private_office = config[constants.DEN_OFICINA_PRIVADA] * (po_factor * individual_spaces)
+        phonebooth = (1 - po_factor - op_factor) * individual_spaces * config[constants.DEN_PHONEBOOTH]
+        formal_collaborative = config[constants.DEN_COLABORATIVO_FORMAL] * (fc_factor * collaborative)
+        informal_collaborative = collaborative * (1 - fc_factor) * config[constants.DEN_COLABORATIVO_INFORMAL]
+
+        den_support = config[constants.DEN_SOPORTE]
+        support = (private_office + open_plan) * (den_support / (100.0 - den_support))
+        den_circ = config[constants.DEN_CIRCULACIONES]
+        circulations = (private_office + open_plan + support) * (den_circ / (100.0 - den_circ))
+
+    except Exception as e:
+        app.logger.error(f"area_breakdown -> Message: {e}")
+        raise e
+
+    total = support + \
+            circulations + \
+            private_office + \
+            open_plan + \
+            phonebooth + \
+            formal_collaborative + \
+            informal_collaborative
+
+    return {
+        'open_plan': open_plan,
+        'private_office': private_office,
+        'phonebooth': phonebooth,
+        'formal_collaborative': formal_collaborative,
+        'informal_collaborative': informal_collaborative,
+        'support': support,
+        'circulations': circulations,
+        'total': total
+    }
+
+
 def area_calc(hotdesking, grade_of_collaboration, workers_number):
     """
     Calc the total area given hotdesking level, grade of collaboration and number of workers
@@ -376,11 +963,113 @@ def area_calc(hotdesking, grade_of_collaboration, workers_number):
     :param workers_number: workers_number: Integer number between 0 to 1000
     :return: Total area needed
     """
+    # Every term is linear in workers_number, so in range it's a single multiply
+    coefficient = get_config().area_coefficient(hotdesking, grade_of_collaboration)
+    if coefficient is not None:
+        return coefficient * workers_number
+
+    return area_breakdown(hotdesking, grade_of_collaboration, workers_number)['total']
+
+
+def _as_numbers(values, name):
+    """
+    Convert a flat sequence of finite numbers to a float array, without
+    coercing strings, None or booleans
+    """
+    array = np.asarray(values)
+    if array.ndim != 1 or (array.size and array.dtype.kind not in 'iuf') or not np.isfinite(array).all():
+        raise ValueError(f"{name} must be a flat sequence of numbers")
+    return array.astype(np.float64)
+
+
+def area_calc_batch(hotdesking, grade_of_collaboration, workers_number):
+    """
+    Vectorized version of area_calc. Calc the total area of many scenarios at
+    once, with the same results as area_calc.
+    :param hotdesking: Sequence of integer numbers between 70 and 100
+    :param grade_of_collaboration: Sequence of integers between 30 and 50
+    :param workers_number: Sequence of integer numbers between 0 to 1000
+    :return: numpy array with the total area needed of each scenario
+    :raise ValueError: If the sequences aren't flat, of numbers and of the same length
+    """
+    hotdesking = _as_numbers(hotdesking, 'hotdesking')
+    grade_of_collaboration = _as_numbers(grade_of_collaboration, 'grade_of_collaboration')
+    workers_number = _as_numbers(workers_number, 'workers_number')
+    if not len(hotdesking) == len(grade_of_collaboration) == len(workers_number):
+        raise ValueError("The sequences must have the same length")
+
+    config = get_config()
+    coefficients = config.area_coefficients
+    if coefficients is None:
+        return _area_calc_arrays(config, hotdesking, grade_of_collaboration, workers_number)
+
+    compiled = (hotdesking >= MIN_HOTDESKING) & (hotdesking <= MAX_HOTDESKING) & \
+               (grade_of_collaboration >= MIN_COLLABORATION) & (grade_of_collaboration <= MAX_COLLABORATION) & \
+               (hotdesking == np.floor(hotdesking)) & (grade_of_collaboration == np.floor(grade_of_collaboration))
+
+    areas = np.empty(np.broadcast(hotdesking, grade_of_collaboration, workers_number).shape)
+    hotdesking, grade_of_collaboration, workers_number = \
+        np.broadcast_arrays(hotdesking, grade_of_collaboration, workers_number)
+    hd_index = hotdesking[compiled].astype(np.intp) - MIN_HOTDESKING
+    gc_index = grade_of_collaboration[compiled].astype(np.intp) - MIN_COLLABORATION
+    areas[compiled] = coefficients[hd_index, gc_index] * workers_number[compiled]
+
+    generic = ~compiled
+    if generic.any():
+        areas[generic] = _area_calc_arrays(config, hotdesking[generic],
+                                           grade_of_collaboration[generic], workers_number[generic])
+    return areas
+
+
+def compile_area_coefficients(config):
+    """
+    Compile the total area per worker for every (hotdesking, collaboration)
+    pair in range. For fixed constants every term of the area is linear in
+    workers_number, so area_calc becomes coefficient * workers_number.
+    :param config: ConfigSnapshot with the constants
+    :return: numpy array of shape (hotdesking levels, collaboration levels)
+    """
+    hotdesking, grade_of_collaboration = np.meshgrid(
+        np.arange(MIN_HOTDESKING, MAX_HOTDESKING + 1, dtype=np.float64),
+        np.arange(MIN_COLLABORATION, MAX_COLLABORATION + 1, dtype=np.float64),
+        indexing='ij')
+    return _area_calc_arrays(config, hotdesking, grade_of_collaboration, np.ones_like(hotdesking))
+
 
-    return m2_support(hotdesking, workers_number) + \
-           m2_circulations(hotdesking, workers_number) + \
-           m2_private_office(hotdesking, workers_number) + \
-           m2_open_plan(hotdesking, workers_number) + \
-           m2_phonebooth(hotdesking, workers_number) + \
-           m2_formal_collaborative(hotdesking, grade_of_collaboration, workers_number) + \
-           m2_informal_collaborative(hotdesking, grade_of_collaboration, workers_number)
\ No newline at end of file
+def _area_calc_arrays(config, hotdesking, grade_of_collaboration, workers_number):
+    """
+    Calc the total area over numpy arrays with the same formulas (and operation
+    order) as area_breakdown
+    """
+    try:
+        op_factor = config[constants.FACTOR_OPEN_PLAN]
+        den_support = config[constants.DEN_SOPORTE]
+        den_circ = config[constants.DEN_CIRCULACIONES]
+
+        with np.errstate(divide='raise', invalid='raise'):
+            individual_spaces = hotdesking * workers_number / 100.0
+            po_factor = np.where(hotdesking < 70, 0.0, np.where(hotdesking < 85, 0.05, 0.1))
+            fc_factor = np.where(grade_of_collaboration < 37, 0.9,
+                                 np.where(grade_of_collaboration < 43, 0.7, 0.5))
+            collaborative = (grade_of_collaboration * individual_spaces * 1.0) / (100.0 - grade_of_collaboration)
+
+            open_plan = op_factor * individual_spaces * float(config[constants.DEN_PUESTO_TRABAJO_OPEN])
+            private_office = config[constants.DEN_OFICINA_PRIVADA] * (po_factor * individual_spaces)
+            phonebooth = (1 - po_factor - op_factor) * individual_spaces * config[constants.DEN_PHONEBOOTH]
+            formal_collaborative = config[constants.DEN_COLABORATIVO_FORMAL] * (fc_factor * collaborative)
+            informal_collaborative = collaborative * (1 - fc_factor) * config[constants.DEN_COLABORATIVO_INFORMAL]
+
+            support = (private_office + open_plan) * (den_support / (100.0 - den_support))
+            circulations = (private_office + open_plan + support) * (den_circ / (100.0 - den_circ))
+
+            return support + \
+                   circulations + \
+                   private_office + \
+                   open_plan + \
+                   phonebooth + \
+                   formal_collaborative + \
+                   informal_collaborative
+
+    except Exception as e:
+        app.logger.error(f"area_calc_batch -> Message: {e}")
+        raise e
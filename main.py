@@ -1,13 +1,19 @@
-import jwt
 import requests
-import json
-import math
-from lib import app, os, db, abort, jsonify, request, num_private_office, total_open_plan, num_formal_collaborative, num_informal_collaborative, num_phonebooth, area_calc, M2InternalConfigVar
+from lib import app, os, db, abort, request, get_config, area_calc, area_breakdown, area_calc_batch, M2InternalConfigVar, M2QuantityRule, reload_config, bump_config_version, bump_config_revision, init_db, pool_stats, get_config_version, pinned_config, config_history, config_versions
+from rules import RuleContext, RuleSet, evaluate_rules
+from catalog import SpacesCatalogCache
+from response_cache import ResponseCache
+from auth import token_verifier, PublicKeyUnavailable
+import metrics
+from profiling import PROFILE_HEADER, is_profiling_admin, requested_profile_mode, run_profiled, save_profile, profile_report
+from json_provider import json_response, stream_response, dumps_with_raw_field, dumps as json_dumps, loads as json_loads
+from http_client import ServiceClient, submit_outbound, reset_outbound_executor
 from flask_swagger import swagger
 from flask_swagger_ui import get_swaggerui_blueprint
 from functools import wraps
+from flask import make_response
 from flask_cors import CORS
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, bindparam, select
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -21,17 +27,33 @@ PROJECTS_MODULE_HOST = os.getenv('PROJECTS_MODULE_HOST', '127.0.0.1')
 PROJECTS_MODULE_PORT = os.getenv('PROJECTS_MODULE_PORT', 5000)
 PROJECTS_MODULE_API = os.getenv('PROJECTS_MODULE_API', '/api/projects/')
 PROJECTS_URL = f"http://{PROJECTS_MODULE_HOST}:{PROJECTS_MODULE_PORT}"
+SPACES_CATALOG_TTL = float(os.getenv('SPACES_CATALOG_TTL', 300))
+SPACES_CATALOG_STALE_TTL = float(os.getenv('SPACES_CATALOG_STALE_TTL', 3600))
+SPACES_CATALOG_TIMEOUT = float(os.getenv('SPACES_CATALOG_TIMEOUT', 10))
+M2_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('M2_RESPONSE_CACHE_MAX_ENTRIES', 1024))
+M2_RESPONSE_CACHE_MAX_BYTES = int(os.getenv('M2_RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+M2_RESPONSE_CACHE_TTL = float(os.getenv('M2_RESPONSE_CACHE_TTL', 0))
+M2_BATCH_MAX_SCENARIOS = int(os.getenv('M2_BATCH_MAX_SCENARIOS', 10000))
+
+projects_client = ServiceClient('projects')
+spaces_client = ServiceClient('spaces')
+
+spaces_catalog = SpacesCatalogCache(
+    'http://' + SPACES_MODULE_HOST + ':' + str(SPACES_MODULE_PORT) + SPACES_MODULE_API_CREATE,
+    ttl=SPACES_CATALOG_TTL,
+    stale_ttl=SPACES_CATALOG_STALE_TTL,
+    timeout=SPACES_CATALOG_TIMEOUT,
+    client=spaces_client)
+
+# Serialized M2 configurations by project ID, validated with M2Generated.revision
+m2_response_cache = ResponseCache(
+    max_entries=M2_RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=M2_RESPONSE_CACHE_MAX_BYTES,
+    ttl=M2_RESPONSE_CACHE_TTL)
 
 CORS(app)
+metrics.init_app(app)
 
-try:
-    f = open('oauth-public.key', 'r')
-    key: str = f.read()
-    f.close()
-    app.config['SECRET_KEY'] = key
-except Exception as e:
-    app.logger.error(f'Can\'t read public key f{e}')
-    exit(-1)
 
 class M2Generated(db.Model):
     """
@@ -46,6 +68,8 @@ class M2Generated(db.Model):
     workers_number: Value of Workers number
     area: Value of calculated Area
     density: Area density value
+    config_version: Version of the M2 constants the area was calculated with
+    revision: Incremented on every save, it validates the cached responses of every worker
     """
     id = db.Column(db.Integer, primary_key=True)
     hot_desking_level = db.Column(db.Integer, nullable=False)
@@ -54,6 +78,8 @@ class M2Generated(db.Model):
     area = db.Column(db.Float, nullable=False)
     density = db.Column(db.Float, nullable=False)
     project_id = db.Column(db.Integer, nullable=False, unique=True)
+    config_version = db.Column(db.Integer)
+    revision = db.Column(db.Integer, nullable=False, default=1)
     workspaces = db.relationship(
         "M2GeneratedWorkspace",
         backref="m2_generated",
@@ -74,6 +100,7 @@ class M2Generated(db.Model):
             'area': self.area,
             'density': self.density,
             'project_id': self.project_id,
+            'config_version': self.config_version,
             'workspaces': workspaces_dicts
         }
         return dict
@@ -82,7 +109,7 @@ class M2Generated(db.Model):
         """
         Serialize to json
         """
-        return jsonify(self.to_dict())
+        return json_response(self.to_dict())
 
 class M2GeneratedWorkspace(db.Model):
     """
@@ -125,10 +152,8 @@ class M2GeneratedWorkspace(db.Model):
         """
         Serialize to json
         """
-        return jsonify(self.to_dict())
+        return json_response(self.to_dict())
 
-db.create_all()
-    
 # Swagger Config
 
 SWAGGER_URL = '/api/m2/docs/'
@@ -143,91 +168,129 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
-def round_half_up(n, decimals=0):
-    multiplier = 10 ** decimals
-    return math.floor(n*multiplier + 0.5) / multiplier
+def obs_and_quantity_calculator(category_name, subcategory, hotdesking, grade_of_collaboration, workers_number, area, intermediates=None):
+    ctx = RuleContext(hotdesking, grade_of_collaboration, workers_number, area, intermediates=intermediates)
+    return evaluate_rules(category_name, subcategory, ctx)
 
-def obs_and_quantity_calculator(category_name, subcategory, hotdesking, grade_of_collaboration, workers_number, area):
-    if(category_name == "Area Soporte Reuniones Informales"):
-        obs_switcher = {
-          "Pequeño": num_informal_collaborative(hotdesking, grade_of_collaboration, workers_number)*0.2,
-          "Mediano": num_informal_collaborative(hotdesking, grade_of_collaboration, workers_number)*0.3,
-          "Grande": num_informal_collaborative(hotdesking, grade_of_collaboration, workers_number)*0.5
-        }
-        obs = obs_switcher[subcategory['name']]
-    elif(category_name == "Sala Reunión"):
-        obs = num_formal_collaborative(hotdesking, grade_of_collaboration, workers_number) * subcategory['usage_percentage']
-    else:
-        obs = None
-
-    if(category_name == "Puestos Trabajo"):
-        quantity = round_half_up(total_open_plan(hotdesking, workers_number))
-    elif(category_name == "Area Servicios" and subcategory['name'] == "Baños"):
-        if(workers_number < 11):
-            quantity = 1
-        elif(11 <= workers_number < 31):
-            quantity = 2
-        elif(31 <= workers_number < 51):
-            quantity = 3
-        elif(51 <= workers_number < 71):
-            quantity = 4
-        elif(71 <= workers_number < 91):
-            quantity = 5
-        elif(91 <= workers_number < 101):
-            quantity = 6
-        else:
-            quantity = round_half_up(6 + ((workers_number-100)/15))
-    elif(category_name == "Sala Reunión"):
-        quantity = round_half_up(obs/subcategory['people_capacity'])
-    elif(category_name == "Especiales"):
-        quantity = 0
-    else:
-        quantity_switcher = {
-            "Puestos Trabajo Privado":{
-                "Privado Pequeño": round_half_up(num_private_office(hotdesking, workers_number)*0.7),
-                "Privado Grande": round_half_up(num_private_office(hotdesking, workers_number)*0.3)
-            },
-            "Area Soporte":{
-                "Recepción Pequeña (más Lounge Pequeño)": 1 if area <= 1000 else 0,
-                "Recepción Grande (más Lounge Grande)": 1 if area >= 1000 else 0,
-                "Quiet Room": round_half_up(num_phonebooth(hotdesking, workers_number)*0.5),
-                "Phonebooth": round_half_up(num_phonebooth(hotdesking, workers_number)*0.5),
-                "Workcoffee/Comedor Mediano": 1 if (501 <= area <= 1500) else 0,
-                "Workcoffee/Comedor Grande": 1 if (area >= 1202) else 0,
-                "Guardado Simple Bajo": 0,
-                "Guardado Simple Alto": 0,
-                "Locker": 0
-            },
-            "Area Soporte Reuniones Informales":{
-                "Pequeño": round_half_up(obs/4) if obs is not None else None,
-                "Mediano": round_half_up(obs/9) if obs is not None else None,
-                "Grande": round_half_up(obs/13) if obs is not None else None
-            },
-            "Area Servicios":{
-                "Kitchenette": 1 if area < 500 else 0,
-                "Servidor 1 Gabinete": 1 if area < 500 else 0,
-                "Servidor 2 Gabinetes": 1 if (501 <= area <= 1500) else 0,
-                "Servidor 3 Gabinetes": 1 if area > 1501 else 0,
-                "Baño Accesibilidad Universal": 1 if area > 500 else 0,
-                "Print Pequeño": round_half_up(1 + (area/600)),
-                "Print Grande": round_half_up(area/1200),
-                "Sala Lactancia": 0,
-                "Bodega": 0,
-                "Coffee point": 0
-            }
-        }
-        quantity = quantity_switcher[category_name][subcategory['name']]
-        
-    obs = int(round_half_up(obs)) if obs is not None else None
+def sync_workspaces(m2_gen_id, workspaces, is_new=False):
+    """
+    Compare the incoming workspaces with the stored ones of a M2Generated and
+    issue only the needed INSERT, UPDATE and DELETE statements. It doesn't commit.
+    :param m2_gen_id: ID of the M2Generated
+    :param workspaces: List of dicts with space_id, quantity and observation
+    :param is_new: True if the M2Generated was just created, so there's nothing stored
+    :return: Dict with the inserted, updated and deleted space ids
+    """
+    table = M2GeneratedWorkspace.__table__
+    incoming = {workspace['space_id']: workspace for workspace in workspaces}
+    stored = {}
+    if not is_new:
+        stored = {row.space_id: row for row in db.session.execute(
+            select(table.c.id, table.c.space_id, table.c.quantity, table.c.observation)
+            .where(table.c.m2_gen_id == m2_gen_id))}
+
+    inserted = [dict(workspace, m2_gen_id=m2_gen_id)
+                for space_id, workspace in incoming.items() if space_id not in stored]
+    updated = [space_id for space_id, workspace in incoming.items()
+               if space_id in stored and
+                  (stored[space_id].quantity, stored[space_id].observation) !=
+                  (workspace['quantity'], workspace['observation'])]
+    deleted = [row for space_id, row in stored.items() if space_id not in incoming]
 
-    return int(quantity), obs
+    if deleted:
+        db.session.execute(table.delete().where(table.c.id.in_([row.id for row in deleted])))
+    if updated:
+        db.session.execute(table.update()
+                           .where(table.c.id == bindparam('_id'))
+                           .values(quantity=bindparam('quantity'),
+                                   observation=bindparam('observation')),
+                           [{'_id': stored[space_id].id,
+                             'quantity': incoming[space_id]['quantity'],
+                             'observation': incoming[space_id]['observation']}
+                            for space_id in updated])
+    if inserted:
+        db.session.execute(table.insert(), inserted)
+
+    return {
+        'inserted': sorted(workspace['space_id'] for workspace in inserted),
+        'updated': sorted(updated),
+        'deleted': sorted(row.space_id for row in deleted)
+    }
+
+def load_m2_generated_data(project_id):
+    """
+    Load the M2Generated of a project with its workspaces in a single query,
+    building the dicts straight from the rows (same output as M2Generated.to_dict()).
+    :param project_id: ID of the project
+    :return: Dict with the M2Generated data and its workspaces, or None if it doesn't exist
+    """
+    m2_table = M2Generated.__table__
+    workspace_table = M2GeneratedWorkspace.__table__
+    stmt = (select(m2_table.c.id, m2_table.c.hot_desking_level, m2_table.c.collaboration_level,
+                   m2_table.c.workers_number, m2_table.c.area, m2_table.c.density,
+                   m2_table.c.project_id, m2_table.c.config_version,
+                   workspace_table.c.id, workspace_table.c.observation,
+                   workspace_table.c.quantity, workspace_table.c.space_id)
+            .select_from(m2_table.outerjoin(workspace_table,
+                                            workspace_table.c.m2_gen_id == m2_table.c.id))
+            .where(m2_table.c.project_id == project_id)
+            .order_by(workspace_table.c.id))
+    rows = db.session.execute(stmt).all()
+    if not rows:
+        return None
+
+    m2_gen_id, hot_desking_level, collaboration_level, workers_number, area, density, project_id, config_version = \
+        rows[0][:8]
+    return {
+        'id': m2_gen_id,
+        'hot_desking_level': hot_desking_level,
+        'collaboration_level': collaboration_level,
+        'workers_number': workers_number,
+        'area': area,
+        'density': density,
+        'project_id': project_id,
+        'config_version': config_version,
+        'workspaces': [{
+            'id': row[8],
+            'observation': row[9],
+            'quantity': row[10],
+            'space_id': row[11],
+            'm2_gen_id': m2_gen_id
+        } for row in rows if row[8] is not None]
+    }
+
+def load_m2_generated_json(project_id):
+    """
+    Get the serialized M2 configuration of a project, from the response cache or
+    from the database (caching it). The cached value is only used while the
+    revision of the project is the same, so a save handled by any worker is
+    seen right away.
+    :param project_id: ID of the project
+    :return: JSON bytes, or None if the project doesn't have a M2 configuration
+    """
+    revision = db.session \
+        .query(M2Generated.revision) \
+        .filter_by(project_id=project_id) \
+        .scalar()
+    if revision is None:
+        return None
+    key = str(project_id)
+    m2_config_json = m2_response_cache.get(key, revision)
+    if m2_config_json is None:
+        generation = m2_response_cache.generation()
+        m2_config_data = load_m2_generated_data(project_id)
+        if m2_config_data is None:
+            return None
+        m2_config_json = json_dumps(m2_config_data)
+        m2_response_cache.set(key, m2_config_json, generation, revision)
+    return m2_config_json
 
 def get_project_by_id(project_id, token):
     headers = {'Authorization': token}
     api_url = PROJECTS_URL + PROJECTS_MODULE_API + str(project_id)
-    rv = requests.get(api_url, headers=headers)
+    rv = projects_client.get(api_url, headers=headers)
     if rv.status_code == 200:
-        return json.loads(rv.text)
+        return json_loads(rv.content)
     elif rv.status_code == 500:
       raise Exception("Cannot connect to the projects module")
     return None
@@ -235,13 +298,44 @@ def get_project_by_id(project_id, token):
 def update_project_by_id(project_id, data, token):
   headers = {'Authorization': token}
   api_url = PROJECTS_URL + PROJECTS_MODULE_API + str(project_id)
-  rv = requests.put(api_url, json=data, headers=headers)
+  rv = projects_client.put(api_url, json=data, headers=headers)
   if rv.status_code == 200:
-    return json.loads(rv.text)
+    return json_loads(rv.content)
   elif rv.status_code == 500:
     raise Exception("Cannot connect to the projects module")
   return None
 
+def config_for_version(version):
+    """
+    Get the config snapshot asked by a request
+    :param version: Config version, None for the current one
+    :return: ConfigSnapshot, or None if the version isn't an integer or doesn't exist
+    """
+    if version is None:
+        return get_config()
+    if isinstance(version, bool) or not isinstance(version, int):
+        return None
+    return get_config_version(version)
+
+def profiled_view(f, mode, *args, **kwargs):
+    """
+    Run a view under cProfile (see profiling.py)
+    :param f: View function
+    :param mode: 'store' to save the profile and return its name in the X-Profile-Id header,
+    'text' to return the report of the profile instead of the response of the view
+    :return: Response
+    """
+    rv, profile = run_profiled(f, *args, **kwargs)
+    if profile is None:
+        response = make_response(rv)
+        response.headers['X-Profile-Id'] = 'busy'
+        return response
+    if mode == 'text':
+        return app.response_class(profile_report(profile), status=200, mimetype='text/plain')
+    response = make_response(rv)
+    response.headers['X-Profile-Id'] = save_profile(profile, request.url_rule.rule)
+    return response
+
 def token_required(f):  
     @wraps(f)  
     def decorator(*args, **kwargs):
@@ -251,23 +345,28 @@ def token_required(f):
             token = bearer_token.split(" ")[1]
         except Exception as ierr:
             app.logger.error(ierr)
-            return jsonify({'message': 'a valid bearer token is missing'}), 500
+            return json_response({'message': 'a valid bearer token is missing'}, 500)
 
         if not token:
             app.logger.debug("token_required")
-            return jsonify({'message': 'a valid token is missing'})
+            return json_response({'message': 'a valid token is missing'})
 
-        app.logger.debug("Token: " + token)
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'],
-                              algorithms=['RS256'], audience="1")
+            data = token_verifier.verify(token)
             user_id: int = data['user_id']
             request.environ['user_id'] = user_id
-        except Exception as err:
-            return jsonify({'message': 'token is invalid', 'error': err})
+            request.environ[metrics.TIMING_HEADERS_ENVIRON] = is_profiling_admin(user_id)
+        except PublicKeyUnavailable as kerr:
+            app.logger.error(f"token_required -> {kerr}")
+            return json_response({'message': 'the token can\'t be verified'}, 500)
         except KeyError as kerr:
-            return jsonify({'message': 'Can\'t find user_id in token', 'error': kerr})
+            return json_response({'message': 'Can\'t find user_id in token', 'error': str(kerr)})
+        except Exception as err:
+            return json_response({'message': 'token is invalid', 'error': str(err)})
 
+        mode = requested_profile_mode(request.headers.get(PROFILE_HEADER), user_id)
+        if mode is not None:
+            return profiled_view(f, mode, *args, **kwargs)
         return f(*args, **kwargs)
 
     return decorator
@@ -275,7 +374,7 @@ def token_required(f):
 @app.route("/api/m2/spec", methods=['GET'])
 @token_required
 def spec():
-    return jsonify(swagger(app))
+    return json_response(swagger(app))
 
 @app.route('/api/m2', methods = ['POST'])
 @token_required
@@ -305,13 +404,18 @@ def get_m2_value():
             num_of_workers:
                 type: integer
                 description: num of workers
+            config_version:
+                type: integer
+                description: Version of the constants to use (optional, the current one by default)
         responses:
           201:
-            description: "Area value"
+            description: "Area value and the version of the constants used"
+          400:
+            description: "Missing data in the request body or unknown config version"
           500:
             description: "Server error"
     """
-    if request.json.keys() != {'hotdesking_level','collaboration_level','num_of_workers'}:
+    if request.json.keys() - {'config_version'} != {'hotdesking_level','collaboration_level','num_of_workers'}:
         return f'Missing data in the body request', 400
     
     try:
@@ -319,18 +423,153 @@ def get_m2_value():
         collaboration_level = request.json['collaboration_level']
         workers_num = request.json['num_of_workers']
 
-        area = area_calc(hotdesking_level, collaboration_level, workers_num)
+        config = config_for_version(request.json.get('config_version'))
+        if config is None:
+            return f"Config version {request.json['config_version']} doesn't exist", 400
+        with pinned_config(config):
+            area = area_calc(hotdesking_level, collaboration_level, workers_num)
 
         if(area):
-            return jsonify({'area': area}), 200
+            return json_response({'area': area, 'config_version': config.version}, 200)
 
-        return jsonify({'message': "Error, the area could not be calculated. Try again."}), 500
+        return json_response({'message': "Error, the area could not be calculated. Try again."}, 500)
     
     except Exception as exp:
         msg = f"Error: mesg ->{exp}"
         app.logger.error(msg)
         return msg, 500
 
+@app.route('/api/m2/breakdown', methods = ['POST'])
+@token_required
+def get_m2_breakdown():
+    """
+        Get M2 area breakdown by kind of space
+        ---
+        produces:
+        - "application/json"
+        tags:
+        - "M2"
+        parameters:
+        - in: "body"
+          name: "body"
+          description: "Data required for M2 area breakdown to be generated"
+          required:
+            - hotdesking_level
+            - collaboration_level
+            - num_of_workers
+          properties:
+            hotdesking_level:
+                type: number
+                description: Hotdesking level
+            collaboration_level:
+                type: number
+                description: Collaboration Level
+            num_of_workers:
+                type: integer
+                description: num of workers
+            config_version:
+                type: integer
+                description: Version of the constants to use (optional, the current one by default)
+        responses:
+          200:
+            description: "Area of each kind of space, the total area and the version of the constants used"
+          400:
+            description: "Missing data in the request body or unknown config version"
+          500:
+            description: "Server error"
+    """
+    if request.json.keys() - {'config_version'} != {'hotdesking_level','collaboration_level','num_of_workers'}:
+        return f'Missing data in the body request', 400
+
+    try:
+        hotdesking_level = request.json['hotdesking_level']
+        collaboration_level = request.json['collaboration_level']
+        workers_num = request.json['num_of_workers']
+
+        config = config_for_version(request.json.get('config_version'))
+        if config is None:
+            return f"Config version {request.json['config_version']} doesn't exist", 400
+        with pinned_config(config):
+            breakdown = area_breakdown(hotdesking_level, collaboration_level, workers_num)
+        breakdown['config_version'] = config.version
+        return json_response(breakdown, 200)
+
+    except Exception as exp:
+        msg = f"Error: mesg ->{exp}"
+        app.logger.error(msg)
+        return msg, 500
+
+@app.route('/api/m2/batch', methods = ['POST'])
+@token_required
+def get_m2_values_batch():
+    """
+        Get M2 area of many scenarios
+        ---
+        produces:
+        - "application/json"
+        tags:
+        - "M2"
+        parameters:
+        - in: "body"
+          name: "body"
+          description: "Scenarios for which the M2 area is calculated"
+          required:
+            - scenarios
+          properties:
+            scenarios:
+              type: array
+              items:
+                type: object
+                properties:
+                  hotdesking_level:
+                    type: number
+                    description: Hotdesking level
+                  collaboration_level:
+                    type: number
+                    description: Collaboration Level
+                  num_of_workers:
+                    type: integer
+                    description: num of workers
+            config_version:
+              type: integer
+              description: Version of the constants to use for every scenario (optional, the current one by default)
+        responses:
+          200:
+            description: "Area value of each scenario, in the same order, and the version of the constants used"
+          400:
+            description: "Missing data in the request body, a value that isn't a number, too many scenarios or unknown config version"
+          500:
+            description: "Server error"
+    """
+    if request.json.keys() - {'config_version'} != {'scenarios'} or not isinstance(request.json['scenarios'], list):
+        return f'Missing data in the body request', 400
+
+    scenarios = request.json['scenarios']
+    if len(scenarios) > M2_BATCH_MAX_SCENARIOS:
+        return f'Too many scenarios, the maximum is {M2_BATCH_MAX_SCENARIOS}', 400
+    try:
+        hotdesking_levels = [scenario['hotdesking_level'] for scenario in scenarios]
+        collaboration_levels = [scenario['collaboration_level'] for scenario in scenarios]
+        workers_nums = [scenario['num_of_workers'] for scenario in scenarios]
+    except (KeyError, TypeError):
+        return f'Missing data in the body request', 400
+    for value in hotdesking_levels + collaboration_levels + workers_nums:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f'Every value of the scenarios must be a number', 400
+
+    try:
+        config = config_for_version(request.json.get('config_version'))
+        if config is None:
+            return f"Config version {request.json['config_version']} doesn't exist", 400
+        with pinned_config(config):
+            areas = area_calc_batch(hotdesking_levels, collaboration_levels, workers_nums)
+        return json_response({'areas': areas.tolist(), 'config_version': config.version}, 200)
+
+    except Exception as exp:
+        msg = f"Error: mesg ->{exp}"
+        app.logger.error(msg)
+        return msg, 500
+
 @app.route('/api/m2/generate', methods = ['POST'])
 @token_required
 def generate_workspaces():
@@ -376,27 +615,24 @@ def generate_workspaces():
         
     try:
         token = request.headers.get('Authorization', None)
-        headers = {'Authorization': token}
-        api_url = 'http://'+ SPACES_MODULE_HOST + ':' + str(SPACES_MODULE_PORT) + SPACES_MODULE_API_CREATE
-        rv = requests.get(api_url, headers=headers)
-        workspaces = json.loads(rv.text)
+        workspaces = spaces_catalog.get(token)
         data = request.json
         hotdesking_level = data['hotdesking_level']
         grade_of_collaboration = data['collaboration_level']
         workers_number = data['num_of_workers']
         area = data['area']
+        ctx = RuleContext(hotdesking_level, grade_of_collaboration, workers_number, area)
 
         for category in workspaces:
             category_name = category["name"]
-            category["subcategories"][:] = [subcategory for subcategory in category["subcategories"] if len(subcategory['spaces']) > 0]
             for subcategory in category["subcategories"]:
               for space in subcategory['spaces']:
                 space['quantity'] = 0
-              quantity, obs = obs_and_quantity_calculator(category_name, subcategory, hotdesking_level, grade_of_collaboration, workers_number, area)
+              quantity, obs = evaluate_rules(category_name, subcategory, ctx)
               subcategory['spaces'][0]['quantity'] = quantity
               subcategory['observation'] = obs
         data['workspaces'] = workspaces
-        return jsonify(data), 200
+        return stream_response(data, 'workspaces', 200)
     except requests.exceptions.RequestException as exp:
         msg = f"Connection error: ->{exp}"
         app.logger.error(msg)
@@ -492,36 +728,56 @@ def save_workspaces():
         data = request.json
         token = request.headers.get('Authorization', None)
         try:
-            project = get_project_by_id(data['project_id'], token)
+            # Version of the constants the area was calculated with, the current one by default
+            config = config_for_version(data.get('config_version'))
+            if config is None:
+                return f"Config version {data['config_version']} doesn't exist", 400
+
+            project_future = submit_outbound(get_project_by_id, data['project_id'], token)
+
+            # Load and validate the local data while the project is fetched
+            local_error = None
+            try:
+                m2_gen = M2Generated.query.filter_by(project_id=data['project_id']).first()
+                density = data['area']/data['num_of_workers']
+                workspaces = [{'quantity': space['quantity'],
+                               'observation': subcategory['observation'],
+                               'space_id': space['id']}
+                              for category in data['workspaces']
+                              for subcategory in category['subcategories']
+                              for space in subcategory['spaces']]
+            except Exception as e:
+                local_error = e
+
+            project = project_future.result()
             if(project is not None):
-                m2_gen = M2Generated.query.filter_by(project_id=project['id']).first()
-                if m2_gen is not None:
-                    db.session.delete(m2_gen)
-                    db.session.commit()
-                m2_gen = M2Generated()
+                if local_error is not None:
+                    raise local_error
+                # Keep the same M2Generated across saves and write only what changed, all in a single transaction
+                is_new = m2_gen is None
+                if is_new:
+                    m2_gen = M2Generated()
+                    db.session.add(m2_gen)
+                else:
+                    m2_gen.revision = M2Generated.revision + 1
                 m2_gen.hot_desking_level = data['hotdesking_level']
                 m2_gen.collaboration_level = data['collaboration_level']
                 m2_gen.workers_number = data['num_of_workers']
                 m2_gen.area = data['area']
-                m2_gen.density = data['area']/data['num_of_workers']
+                m2_gen.density = density
                 m2_gen.project_id = data['project_id']
+                m2_gen.config_version = config.version
+                db.session.flush()
 
-                for category in data['workspaces']:
-                  for subcategory in category['subcategories']:
-                    for space in subcategory['spaces']:
-                      m2_gen_workspace = M2GeneratedWorkspace()
-                      m2_gen_workspace.quantity = space['quantity']
-                      m2_gen_workspace.observation = subcategory['observation']
-                      m2_gen_workspace.space_id = space['id']
-                      m2_gen.workspaces.append(m2_gen_workspace)
-
-                db.session.add(m2_gen)
+                changes = sync_workspaces(m2_gen.id, workspaces, is_new)
                 db.session.commit()
+                m2_response_cache.invalidate(str(data['project_id']))
 
                 project = update_project_by_id(data['project_id'], {'m2_gen_id': m2_gen.id}, token)
                 if project is not None:
                   project['m2_generated_data'] = m2_gen.to_dict()
-                  return jsonify(project), 201
+                  project['m2_changes'] = changes
+                  return json_response(project, 201)
                 return "Cannot update the Project because doesn't exist", 404          
             else:
                 return "Project doesn't exist or the id is not included on the body", 404
@@ -558,12 +814,22 @@ def get_m2_config_by_project_id(project_id):
     """
     try:
         token = request.headers.get('Authorization', None)
-        project = get_project_by_id(project_id, token)
+        project_future = submit_outbound(get_project_by_id, project_id, token)
+
+        # Load the local data while the project is fetched
+        local_error = None
+        try:
+            m2_config_json = load_m2_generated_json(project_id)
+        except SQLAlchemyError as e:
+            local_error = e
+
+        project = project_future.result()
         if(project is not None):
-            m2_config = M2Generated.query.filter_by(project_id=project_id).first()
-            if m2_config is not None:
-                project['m2_generated_data'] = m2_config.to_dict()
-                return jsonify(project), 200
+            if local_error is not None:
+                raise local_error
+            if m2_config_json is not None:
+                body = dumps_with_raw_field(project, 'm2_generated_data', m2_config_json)
+                return app.response_class(body, status=200, mimetype='application/json')
             else:
                 raise Exception("This Project doesn't have a workspaces configuration created")
         
@@ -583,15 +849,47 @@ def get_all_constants():
         ---
         tags:
         - "M2/Constants"
+        parameters:
+        - in: "query"
+          name: "version"
+          type: integer
+          description: "Config version whose constants are returned (optional, the current ones by default)"
         responses:
           200:
             description: List of constants used to calculate M2 area. 
+          404:
+            description: "The config version doesn't exist"
           500:
             description: "Database error"
     """
     try:
+        version = request.args.get('version', type=int)
+        if version is not None:
+            constants = [c.to_dict() for c in config_history(version)]
+            if not constants:
+                return f"Config version {version} doesn't exist", 404
+            return json_response(constants, 200)
         constants =  [c.to_dict() for c in M2InternalConfigVar.query.all()]
-        return jsonify(constants), 200
+        return json_response(constants, 200)
+    except SQLAlchemyError as e:
+        return f'Error getting data: {e}', 500
+
+@app.route('/api/m2/constants/versions', methods = ['GET'])
+@token_required
+def get_constants_versions():
+    """
+        Get the versions of the M2 constants
+        ---
+        tags:
+        - "M2/Constants"
+        responses:
+          200:
+            description: Current config version and every version with a saved set of constants.
+          500:
+            description: "Database error"
+    """
+    try:
+        return json_response({'current': get_config().version, 'versions': config_versions()}, 200)
     except SQLAlchemyError as e:
         return f'Error getting data: {e}', 500
 
@@ -630,16 +928,192 @@ def update_constants():
         if len(request.json) > 0:
             try:
                 db.session.bulk_update_mappings(M2InternalConfigVar, request.json)
+                bump_config_version()
                 db.session.commit()
+                reload_config()
                 updated_constants =  [c.to_dict() for c in M2InternalConfigVar.query.all()]
-                return jsonify(updated_constants), 200
+                return json_response(updated_constants, 200)
+            except SQLAlchemyError as e:
+                return f'Error getting data: {e}', 500
+        else:
+            return 'Body data required', 400
+    else:
+        return 'Body isn\'t application/json', 400
+
+
+@app.route('/api/m2/rules', methods = ['GET'])
+@token_required
+def get_all_rules():
+    """
+        Get all the rules used to calc the workspaces quantities
+        ---
+        tags:
+        - "M2/Rules"
+        responses:
+          200:
+            description: List of bands of the quantity and observation rules.
+          500:
+            description: "Database error"
+    """
+    try:
+        rules = [r.to_dict() for r in M2QuantityRule.query.all()]
+        return json_response(rules, 200)
+    except SQLAlchemyError as e:
+        return f'Error getting data: {e}', 500
+
+@app.route('/api/m2/rules', methods = ['PUT'])
+@token_required
+def update_rules():
+    """
+        Update or add bands of the rules used to calc the workspaces quantities
+        ---
+        produces:
+        - "application/json"
+        tags:
+        - "M2/Rules"
+        parameters:
+        - in: "body"
+          name: "body"
+          description: "List of bands to be updated (with id) or added (without id)."
+          schema:
+            type: array
+            items:
+              type: object
+              properties:
+                id:
+                  type: integer
+                category:
+                  type: string
+                subcategory:
+                  type: string
+                target:
+                  type: string
+                variable:
+                  type: string
+                lower:
+                  type: number
+                lower_inclusive:
+                  type: boolean
+                upper:
+                  type: number
+                upper_inclusive:
+                  type: boolean
+                value:
+                  type: number
+                factor:
+                  type: number
+                origin:
+                  type: number
+                divisor:
+                  type: number
+        responses:
+          200:
+            description: List of bands of the quantity and observation rules.
+          400:
+            description: Body isn't application/json, empty body data, the bands overlap or a band has an unknown variable or target.
+          500:
+            description: "Database error"
+    """
+    if request.is_json:
+        if len(request.json) > 0:
+            try:
+                updated = [rule for rule in request.json if 'id' in rule]
+                added = [rule for rule in request.json if 'id' not in rule]
+                db.session.bulk_update_mappings(M2QuantityRule, updated)
+                for rule in added:
+                    db.session.add(M2QuantityRule(**rule))
+                db.session.flush()
+                rules = [r.to_dict() for r in M2QuantityRule.query.all()]
+                RuleSet(rules)
+                bump_config_revision()
+                db.session.commit()
+                reload_config()
+                return json_response(rules, 200)
+            except (ValueError, TypeError) as e:
+                db.session.rollback()
+                return f'Invalid rules: {e}', 400
             except SQLAlchemyError as e:
+                db.session.rollback()
                 return f'Error getting data: {e}', 500
         else:
             return 'Body data required', 400
     else:
         return 'Body isn\'t application/json', 400
 
+@app.route('/api/m2/stats', methods = ['GET'])
+@token_required
+def get_stats():
+    """
+        Get the stats of the worker that handles the request
+        ---
+        tags:
+        - "M2/Stats"
+        responses:
+          200:
+            description: Latency stats of the calls to the other modules and counters of the caches.
+    """
+    stats = {
+        'pid': os.getpid(),
+        'http': {
+            projects_client.name: projects_client.stats(),
+            spaces_client.name: spaces_client.stats()
+        },
+        'm2_response_cache': m2_response_cache.stats(),
+        'db_pool': pool_stats()
+    }
+    return json_response(stats, 200)
+
+@app.route('/api/m2/metrics', methods = ['GET'])
+def get_metrics():
+    """
+        Get the metrics of all the workers in the Prometheus text format
+        ---
+        tags:
+        - "M2/Stats"
+        responses:
+          200:
+            description: Request latency histograms by route, SQL statements and time per request, and latency and errors of the calls to the other modules.
+    """
+    return app.response_class(metrics.registry.render(), status=200,
+                              mimetype='text/plain; version=0.0.4')
+
+def create_app():
+    """
+    Application factory, used by gunicorn as `main:create_app()`.
+    Building the app doesn't touch the database: the tables are created with
+    `flask init-db`, and the config vars are loaded on the first request that
+    needs them. The public key is loaded here, so a missing or invalid key file
+    stops the startup.
+    :return: Flask app
+    """
+    token_verifier.public_key.get()
+    if os.getenv('INIT_DB_ON_START', '0') == '1':
+        init_db()
+    return app
+
+def reset_after_fork():
+    """
+    Called in each gunicorn worker after it's forked from a master that preloaded
+    the app (see gunicorn.conf.py). The database connections, HTTP pools and
+    threads of the master can't be shared with the worker.
+    """
+    # Only the engines the master already created, without closing their connections
+    for connector in list(app.extensions['sqlalchemy'].connectors.values()):
+        connector.get_engine().dispose(close=False)
+    projects_client.reset()
+    spaces_client.reset()
+    reset_outbound_executor()
+    metrics.registry.reset()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """
+    Create the tables and load the default config vars and quantity rules
+    """
+    init_db()
+    print("Database initialized")
+
 
 if __name__ == '__main__':
+    init_db()
     app.run(host= APP_HOST, port = APP_PORT, debug = True)
\ No newline at end of file
@@ -0,0 +1,508 @@
+import bisect
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Loading Config Parameters
+# Directory shared by the gunicorn workers, each one writes its metrics there.
+# Without it, /api/m2/metrics only shows the metrics of the worker that answers.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+# Add the X-Query-Count, X-DB-Time and X-Upstream-Time headers to the responses of the
+# requests marked with TIMING_HEADERS_ENVIRON (the ones of profiling admins)
+TIMING_HEADERS = os.getenv('TIMING_HEADERS', '1') == '1'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Key of the WSGI environ set by the views whose caller can see the timing headers
+TIMING_HEADERS_ENVIRON = 'm2.timing_headers'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """
+    Counter.
+    Monotonic counter by label values.
+
+    Attributes
+    ----------
+    name: Name of the metric
+    help: Description of the metric
+    labelnames: Names of the labels
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labelvalues=(), amount=1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labelvalues), value] for labelvalues, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def render(self, samples):
+        for labelvalues, value in sorted(samples.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Histogram.
+    Distribution of observed values by label values, with fixed buckets.
+
+    Attributes
+    ----------
+    name: Name of the metric
+    help: Description of the metric
+    labelnames: Names of the labels
+    buckets: Upper bounds of the buckets (+Inf is added)
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labelvalues=()):
+        # Non cumulative counts per bucket, then the sum and the count
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labelvalues), list(counts)] for labelvalues, counts in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    @staticmethod
+    def merge(total, counts):
+        return list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+
+    def render(self, samples):
+        for labelvalues, counts in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-2])}"
+            yield f"{self.name}_count{labels} {counts[-1]}"
+
+
+class Registry:
+    """
+    Registry.
+    Metrics of this process. When directory is set, each process writes its
+    snapshot to <directory>/<pid>.json (in background, at most every
+    flush_interval seconds) and render() adds up the snapshots of all the
+    processes. When a worker exits, the master folds its snapshot into
+    <directory>/exited.json and removes its file (see retire()), so the
+    directory doesn't grow with recycled workers, a reused PID starts from an
+    empty file and the counters never go back.
+
+    Attributes
+    ----------
+    directory: Directory shared by the processes, or '' to not share them
+    flush_interval: Seconds between writes of the snapshot
+    """
+
+    def __init__(self, directory='', flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._dirty = False
+        self._flusher_pid = None
+        self._flush_lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        """
+        :return: Dict with the samples of each metric of this process
+        """
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        """
+        Drop the samples, e.g. in a worker forked from a master that had some
+        """
+        for metric in self.metrics.values():
+            metric.reset()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._flusher_pid = None
+
+    def flush(self):
+        """
+        Write the snapshot of this process to the shared directory
+        """
+        if not self.directory:
+            return
+        data = json.dumps(self.snapshot()).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, f"{os.getpid()}.json"))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def maybe_flush(self):
+        """
+        Mark the snapshot as changed. A thread of this process writes it at most
+        every flush_interval seconds, so it's cheap enough to be called at the
+        end of every request.
+        """
+        if not self.directory:
+            return
+        self._dirty = True
+        if self._flusher_pid != os.getpid():
+            with self._flush_lock:
+                if self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self._dirty = False
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+    def _locked(self, operation):
+        """
+        Lock of the directory: shared to read the snapshots, exclusive to retire a process
+        """
+        f = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(f, operation)
+        return f
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def merge(self, snapshots):
+        """
+        Add up snapshots
+        :param snapshots: Iterable of snapshots
+        :return: Dict with the merged samples of each metric, by label values
+        """
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for labelvalues, value in samples:
+                    key = tuple(labelvalues)
+                    merged[name][key] = metric.merge(merged[name].get(key), value)
+        return merged
+
+    def collect(self):
+        """
+        Snapshots of all the processes, the one of this process taken now
+        :return: List of snapshots
+        """
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        own = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._locked(fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == own:
+                    continue
+                snapshot = self._read(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return snapshots
+
+    def retire(self, pid):
+        """
+        Fold the snapshot of a process that exited into exited.json and remove
+        its file. It's called by the gunicorn master for every worker that exits.
+        :param pid: PID of the process
+        """
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{pid}.json")
+        exited_path = os.path.join(self.directory, 'exited.json')
+        with self._locked(fcntl.LOCK_EX):
+            snapshot = self._read(path)
+            if snapshot is not None:
+                exited = self._read(exited_path) or {}
+                merged = self.merge([exited, snapshot])
+                # Keep the samples of metrics that aren't registered in this process
+                data = dict(exited, **{name: [[list(labelvalues), value] for labelvalues, value in samples.items()]
+                                       for name, samples in merged.items()})
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(json.dumps(data).encode('utf-8'))
+                os.replace(tmp_path, exited_path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def render(self):
+        """
+        Aggregated metrics in the Prometheus text format
+        :return: str
+        """
+        merged = self.merge(self.collect())
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged[name]))
+        return '\n'.join(lines) + '\n'
+
+
+def clear_directory(directory):
+    """
+    Remove the snapshots left by a previous run, called when gunicorn starts
+    :param directory: Shared directory of the metrics
+    """
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')) + glob.glob(os.path.join(directory, '.tmp-*')) + \
+            [os.path.join(directory, '.lock')]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+registry = Registry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+
+REQUEST_DURATION = registry.histogram(
+    'm2_http_request_duration_seconds', "Latency of the requests by route.", ('route', 'method'))
+REQUESTS = registry.counter(
+    'm2_http_requests_total', "Requests by route and status code.", ('route', 'method', 'status'))
+DB_STATEMENTS_PER_REQUEST = registry.histogram(
+    'm2_db_statements_per_request', "SQL statements executed by each request.", ('route',), COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = registry.histogram(
+    'm2_db_time_per_request_seconds', "Time spent executing SQL statements by each request.", ('route',))
+DB_STATEMENTS = registry.counter(
+    'm2_db_statements_total', "SQL statements executed.")
+DB_TIME = registry.counter(
+    'm2_db_time_seconds_total', "Time spent executing SQL statements.")
+OUTBOUND_DURATION = registry.histogram(
+    'm2_outbound_request_duration_seconds', "Latency of the calls to the other modules.", ('service',))
+OUTBOUND_ERRORS = registry.counter(
+    'm2_outbound_errors_total', "Calls to the other modules that failed or returned a 5xx status.", ('service',))
+
+
+class RequestTimings:
+    """
+    RequestTimings.
+    SQL statements and calls to other modules made by a request. It's kept in a
+    context variable, so the calls made from the outbound thread pool (which
+    runs them in a copy of the request context) are added to the same request.
+
+    Attributes
+    ----------
+    statements: SQL statements executed
+    db_time: Seconds spent executing them
+    upstream_calls: Calls to the other modules
+    upstream_time: Seconds spent in those calls
+    """
+    __slots__ = ('statements', 'db_time', 'upstream_calls', 'upstream_time', '_lock')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.upstream_calls = 0
+        self.upstream_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_statement(self, elapsed):
+        with self._lock:
+            self.statements += 1
+            self.db_time += elapsed
+
+    def add_upstream_call(self, elapsed):
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_time += elapsed
+
+
+_request_timings = ContextVar('m2_request_timings', default=None)
+
+
+def current_timings():
+    """
+    :return: RequestTimings of the current request, or None outside a request
+    """
+    return _request_timings.get()
+
+
+def start_request():
+    _request_timings.set(RequestTimings())
+
+
+def observe_sql(elapsed):
+    """
+    Record a SQL statement
+    :param elapsed: Seconds it took
+    """
+    DB_STATEMENTS.inc()
+    DB_TIME.inc(amount=elapsed)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add_statement(elapsed)
+
+
+def finish_request(route, method, status, elapsed):
+    """
+    Record a request and the SQL statements it executed
+    :param route: URL rule of the route
+    :param method: HTTP method
+    :param status: Status code
+    :param elapsed: Seconds it took
+    :return: RequestTimings of the request
+    """
+    timings = _request_timings.get() or RequestTimings()
+    REQUEST_DURATION.observe(elapsed, (route, method))
+    REQUESTS.inc((route, method, str(status)))
+    DB_STATEMENTS_PER_REQUEST.observe(timings.statements, (route,))
+    DB_TIME_PER_REQUEST.observe(timings.db_time, (route,))
+    _request_timings.set(None)
+    registry.maybe_flush()
+    return timings
+
+
+def observe_outbound(service, elapsed, failed):
+    """
+    Record a call to another module
+    :param service: Name of the module
+    :param elapsed: Seconds it took
+    :param failed: True if it raised or returned a 5xx status
+    """
+    OUTBOUND_DURATION.observe(elapsed, (service,))
+    if failed:
+        OUTBOUND_ERRORS.inc((service,))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add_upstream_call(elapsed)
+
+
+# The start of a statement is kept in its execution context, so a statement
+# that raises doesn't leave it behind on the connection
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._m2_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_m2_start', None)
+    if start is not None:
+        context._m2_start = None
+        observe_sql(time.perf_counter() - start)
+
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    start = getattr(context, '_m2_start', None)
+    if start is not None:
+        context._m2_start = None
+        observe_sql(time.perf_counter() - start)
+
+
+def init_app(app):
+    """
+    Record the metrics of every request of the app and of every SQL statement
+    :param app: Flask app
+    """
+    from flask import request
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_request_metrics():
+        request.environ['m2.start'] = time.perf_counter()
+        start_request()
+
+    @app.after_request
+    def finish_request_metrics(response):
+        start = request.environ.get('m2.start')
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            timings = finish_request(route, request.method, response.status_code, time.perf_counter() - start)
+            if TIMING_HEADERS and request.environ.get(TIMING_HEADERS_ENVIRON):
+                response.headers['X-Query-Count'] = str(timings.statements)
+                response.headers['X-DB-Time'] = f"{timings.db_time:.6f}"
+                response.headers['X-Upstream-Time'] = f"{timings.upstream_time:.6f}"
+        return response
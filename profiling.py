@@ -0,0 +1,104 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+
+# Loading Config Parameters
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+PROFILING_ADMIN_USER_IDS = frozenset(int(user_id) for user_id in os.getenv('PROFILING_ADMIN_USER_IDS', '').split(',')
+                                     if user_id.strip())
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'm2-profiles'))
+PROFILING_REPORT_LIMIT = int(os.getenv('PROFILING_REPORT_LIMIT', 40))
+
+# Header that asks for the profile of a request, with one of PROFILE_MODES
+PROFILE_HEADER = 'X-Profile'
+# store: save the profile in PROFILING_DIR and return its name in X-Profile-Id
+# text: return the report of the profile instead of the response
+PROFILE_MODES = ('store', 'text')
+
+# Only one request is profiled at a time per worker
+_profile_lock = threading.Lock()
+
+
+def is_profiling_admin(user_id, enabled=None, admin_user_ids=None):
+    """
+    Check if a user can profile requests and see their timing headers
+    :param user_id: ID of the authenticated user
+    :param enabled: Override of PROFILING_ENABLED
+    :param admin_user_ids: Override of PROFILING_ADMIN_USER_IDS
+    :return: bool
+    """
+    enabled = PROFILING_ENABLED if enabled is None else enabled
+    admin_user_ids = PROFILING_ADMIN_USER_IDS if admin_user_ids is None else admin_user_ids
+    return enabled and user_id in admin_user_ids
+
+
+def requested_profile_mode(header, user_id, enabled=None, admin_user_ids=None):
+    """
+    Get the profiling mode asked by a request, if the caller is allowed to
+    :param header: Value of the X-Profile header
+    :param user_id: ID of the authenticated user
+    :param enabled: Override of PROFILING_ENABLED
+    :param admin_user_ids: Override of PROFILING_ADMIN_USER_IDS
+    :return: One of PROFILE_MODES, or None if the request won't be profiled
+    """
+    if not header or not is_profiling_admin(user_id, enabled, admin_user_ids):
+        return None
+    mode = header.strip().lower()
+    if mode in ('1', 'true'):
+        mode = 'store'
+    return mode if mode in PROFILE_MODES else None
+
+
+def run_profiled(fn, *args, **kwargs):
+    """
+    Call a function under cProfile
+    :return: Tuple with the result and the cProfile.Profile, or None if another
+             request of this worker is already being profiled
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return fn(*args, **kwargs), None
+    try:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            profile.disable()
+        return result, profile
+    finally:
+        _profile_lock.release()
+
+
+def save_profile(profile, route, directory=None):
+    """
+    Save a profile in the pstats format, it can be read with
+    `python -m pstats <file>` or snakeviz
+    :param profile: cProfile.Profile
+    :param route: Route of the request, part of the file name
+    :param directory: Override of PROFILING_DIR
+    :return: Name of the file
+    """
+    directory = directory or PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', route).strip('-') or 'root'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}.prof"
+    profile.dump_stats(os.path.join(directory, name))
+    return name
+
+
+def profile_report(profile, limit=None):
+    """
+    Text report of the functions with the greatest cumulative time
+    :param profile: cProfile.Profile
+    :param limit: Number of functions, PROFILING_REPORT_LIMIT by default
+    :return: str
+    """
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit or PROFILING_REPORT_LIMIT)
+    return stream.getvalue()
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    ResponseCache.
+    Process-local LRU of already serialized responses. The entries are bounded
+    by number and by total bytes, and expire after ttl seconds (if ttl > 0).
+
+    Each worker has its own cache, so an entry can be stored with a validator
+    (e.g. a revision read from the database) and it's only served while the
+    validator passed to get() is the same, whichever worker changed the data.
+
+    Attributes
+    ----------
+    max_entries: Greatest number of entries
+    max_bytes: Greatest total size of the cached values
+    ttl: Seconds an entry is valid, 0 to keep it until it's evicted or invalidated
+    hits: Number of lookups that found a valid entry
+    misses: Number of lookups that didn't
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=0.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        """
+        Current generation of the cache. It changes on every invalidation, so a value
+        loaded before an invalidation isn't cached after it
+        :return: Value to pass to set()
+        """
+        return self._generation
+
+    def get(self, key, validator=None):
+        """
+        Get a cached value
+        :param key: Key of the entry
+        :param validator: Current validator of the data, the entry is stale if it was stored with another one
+        :return: Cached bytes or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, entry_validator = entry
+                if entry_validator == validator and (expires_at is None or time.monotonic() < expires_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation=None, validator=None):
+        """
+        Cache a value, evicting the least recently used entries if needed
+        :param key: Key of the entry
+        :param value: Serialized value (bytes)
+        :param generation: Value of generation() before the value was loaded
+        :param validator: Validator of the data read before the value was loaded
+        :return: True if the value was cached
+        """
+        size = len(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return False
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, validator)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            return True
+
+    def invalidate(self, key):
+        """
+        Drop an entry
+        :param key: Key of the entry
+        """
+        with self._lock:
+            self._generation += 1
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """
+        Drop all the entries
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Get the counters of the cache
+        :return: Dict with hits, misses, entries and bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def _remove(self, key):
+        value, _, _ = self._entries.pop(key)
+        self._bytes -= len(value)
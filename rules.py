@@ -0,0 +1,208 @@
+import math
+import threading
+from bisect import bisect_right
+
+import constants
+from lib import get_config, quantity_intermediates
+
+
+def round_half_up(n, decimals=0):
+    multiplier = 10 ** decimals
+    return math.floor(n*multiplier + 0.5) / multiplier
+
+
+class CompiledRule:
+    """
+    CompiledRule.
+    Bands of a rule compiled into sorted arrays, so the band of a value is
+    found with a binary search.
+
+    Attributes
+    ----------
+    variable: Name of the variable the rule is evaluated on
+    keys: Sorted start of each segment, as (limit, 0 if the limit belongs to the segment else 1)
+    bands: (value, factor, origin, divisor) of each segment, None outside of every band
+    """
+    __slots__ = ('variable', 'keys', 'bands')
+
+    def __init__(self, variable, rows):
+        self.variable = variable
+        self.keys = [(-math.inf, 0)]
+        self.bands = [None]
+
+        def start_key(row):
+            if row['lower'] is None:
+                return (-math.inf, 0)
+            return (row['lower'], 0 if row['lower_inclusive'] else 1)
+
+        for row in sorted(rows, key=start_key):
+            if row['variable'] != variable:
+                raise ValueError(f"Rule {row['id']} is evaluated on {row['variable']} instead of {variable}")
+            start = start_key(row)
+            if start < self.keys[-1] or (start == self.keys[-1] and self.bands[-1] is not None):
+                raise ValueError(f"Rule {row['id']} overlaps another band")
+            if start == self.keys[-1]:
+                self.bands[-1] = (row['value'], row['factor'], row['origin'], row['divisor'])
+            else:
+                self.keys.append(start)
+                self.bands.append((row['value'], row['factor'], row['origin'], row['divisor']))
+
+            if row['upper'] is not None:
+                end = (row['upper'], 1 if row['upper_inclusive'] else 0)
+                if end <= start:
+                    raise ValueError(f"Rule {row['id']} has an empty band")
+                self.keys.append(end)
+                self.bands.append(None)
+            else:
+                self.keys.append((math.inf, 1))
+                self.bands.append(None)
+
+    def evaluate(self, x):
+        """
+        Calc the result of the band x belongs to
+        :param x: Value of the variable
+        :return: value + factor * (x - origin) / divisor, 0 outside of every band
+        """
+        band = self.bands[bisect_right(self.keys, (x, 0)) - 1]
+        if band is None:
+            return 0
+        value, factor, origin, divisor = band
+        if factor == 0:
+            return value
+        return value + factor * (x - origin) / divisor
+
+
+class RuleSet:
+    """
+    RuleSet.
+    Every rule of the M2QuantityRule table compiled, by (category, subcategory, target).
+    """
+
+    def __init__(self, quantity_rules):
+        groups = {}
+        for row in quantity_rules:
+            if row['variable'] not in constants.VARIABLES:
+                raise ValueError(f"Rule {row['id']} is evaluated on an unknown variable {row['variable']}")
+            if row['target'] not in constants.TARGETS:
+                raise ValueError(f"Rule {row['id']} has an unknown target {row['target']}")
+            groups.setdefault((row['category'], row['subcategory'], row['target']), []).append(row)
+        self.rules = {key: CompiledRule(rows[0]['variable'], rows) for key, rows in groups.items()}
+
+    def find(self, category_name, subcategory_name, target):
+        """
+        Get the rule of a subcategory, or of its whole category
+        :return: CompiledRule, None if there isn't
+        """
+        rule = self.rules.get((category_name, subcategory_name, target))
+        if rule is None:
+            rule = self.rules.get((category_name, None, target))
+        return rule
+
+
+_rule_set_lock = threading.Lock()
+_rule_set = (None, None)
+
+
+def get_rule_set():
+    """
+    Get the compiled rules of the current config, compiling them only when it changed
+    :return: RuleSet
+    """
+    global _rule_set
+
+    config = get_config()
+    compiled_config, rule_set = _rule_set
+    if compiled_config is not config:
+        rule_set = RuleSet(config.quantity_rules)
+        with _rule_set_lock:
+            _rule_set = (config, rule_set)
+    return rule_set
+
+
+class RuleContext:
+    """
+    RuleContext.
+    Inputs shared by the rules of every subcategory of a generate request.
+    The quantity intermediates and the rules are loaded lazily, only once.
+
+    Attributes
+    ----------
+    hotdesking: Integer number between 70 and 100
+    grade_of_collaboration: Integer between 30 and 50
+    workers_number: Integer number between 0 to 1000
+    area: Calculated area
+    """
+    __slots__ = ('hotdesking', 'grade_of_collaboration', 'workers_number', 'area', '_loader', '_intermediates',
+                 '_rule_set')
+
+    def __init__(self, hotdesking, grade_of_collaboration, workers_number, area,
+                 loader=quantity_intermediates, intermediates=None):
+        self.hotdesking = hotdesking
+        self.grade_of_collaboration = grade_of_collaboration
+        self.workers_number = workers_number
+        self.area = area
+        self._loader = loader
+        self._intermediates = intermediates
+        self._rule_set = None
+
+    def __getitem__(self, name):
+        if self._intermediates is None:
+            self._intermediates = self._loader(self.hotdesking, self.grade_of_collaboration, self.workers_number)
+        return self._intermediates[name]
+
+    @property
+    def rule_set(self):
+        if self._rule_set is None:
+            self._rule_set = get_rule_set()
+        return self._rule_set
+
+    def variable(self, name, obs):
+        """
+        Get the value of a variable a rule is evaluated on
+        """
+        if name == constants.VAR_WORKERS_NUMBER:
+            return self.workers_number
+        elif name == constants.VAR_AREA:
+            return self.area
+        elif name == constants.VAR_OBSERVATION:
+            return obs
+        return self[name]
+
+
+# Rules that depend on the subcategory data returned by the spaces module
+CATEGORY_OBSERVATION_RULES = {
+    "Sala Reunión": lambda ctx, subcategory: ctx['num_formal_collaborative'] * subcategory['usage_percentage']
+}
+
+CATEGORY_QUANTITY_RULES = {
+    "Sala Reunión": lambda ctx, subcategory, obs: round_half_up(obs/subcategory['people_capacity'])
+}
+
+
+def evaluate_rules(category_name, subcategory, ctx):
+    """
+    Calc the quantity and observation of a subcategory, evaluating only its rules
+    :param category_name: Name of the category of the subcategory
+    :param subcategory: Subcategory dict, as returned by the spaces module
+    :param ctx: RuleContext of the request
+    :return: tuple (quantity, observation)
+    """
+    obs_rule = CATEGORY_OBSERVATION_RULES.get(category_name)
+    if obs_rule is not None:
+        obs = obs_rule(ctx, subcategory)
+    else:
+        rule = ctx.rule_set.find(category_name, subcategory['name'], constants.TARGET_OBSERVATION)
+        obs = rule.evaluate(ctx.variable(rule.variable, None)) if rule is not None else None
+
+    quantity_rule = CATEGORY_QUANTITY_RULES.get(category_name)
+    if quantity_rule is not None:
+        quantity = quantity_rule(ctx, subcategory, obs)
+    else:
+        rule = ctx.rule_set.find(category_name, subcategory['name'], constants.TARGET_QUANTITY)
+        if rule is None:
+            raise KeyError(f"There isn't a quantity rule for {category_name} - {subcategory['name']}")
+        quantity = round_half_up(rule.evaluate(ctx.variable(rule.variable, obs)))
+
+    obs = int(round_half_up(obs)) if obs is not None else None
+
+    return int(quantity), obs
@@ -0,0 +1,84 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from auth import PublicKey, PublicKeyUnavailable, TokenCache, TokenVerifier
+
+
+def build_token(key, exp_in=3600, **claims):
+    payload = dict({'aud': "1", 'sub': "23", 'user_id': 1, 'exp': int(time.time()) + exp_in}, **claims)
+    return jwt.encode(payload, key, algorithm='RS256').decode('utf-8')
+
+
+class TokenVerifierTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'oauth-public.key')
+        shutil.copy('oauth-public.key', self.path)
+        with open('oauth-private.key', 'r') as f:
+            self.key = f.read()
+        self.verifier = TokenVerifier(PublicKey(self.path, check_interval=0), TokenCache(max_entries=2))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_verified_tokens_are_cached(self):
+        token = build_token(self.key)
+        assert self.verifier.verify(token)['user_id'] == 1
+        with mock.patch('auth.jwt.decode') as decode:
+            assert self.verifier.verify(token)['user_id'] == 1
+            decode.assert_not_called()
+
+        # Bounded by max_entries
+        self.verifier.verify(build_token(self.key, user_id=2))
+        self.verifier.verify(build_token(self.key, user_id=3))
+        assert len(self.verifier.cache) == 2
+
+    def test_invalid_tokens_are_rejected(self):
+        token = build_token(self.key)
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.verifier.verify(token[:-4] + 'AAAA')
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.verifier.verify(build_token(self.key, aud="2"))
+
+    def test_missing_key_is_not_an_invalid_token(self):
+        verifier = TokenVerifier(PublicKey(os.path.join(self.dir, 'missing.key')), TokenCache())
+        with self.assertRaises(PublicKeyUnavailable):
+            verifier.verify(build_token(self.key))
+
+    def test_entries_expire_with_the_token(self):
+        token = build_token(self.key, exp_in=10)
+        digest = TokenCache.digest(token)
+        claims = self.verifier.verify(token)
+        assert self.verifier.cache.get(digest) == claims
+        with mock.patch('auth.time.time', return_value=claims['exp']):
+            assert self.verifier.cache.get(digest) is None
+
+    def test_rotated_key_is_reloaded(self):
+        token = build_token(self.key)
+        self.verifier.verify(token)
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        with open(self.path, 'wb') as f:
+            f.write(private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                          serialization.PublicFormat.SubjectPublicKeyInfo))
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+
+        # The cached token was signed with the old key
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.verifier.verify(token)
+        new_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+        assert self.verifier.verify(build_token(new_pem))['user_id'] == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
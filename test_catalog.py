@@ -0,0 +1,78 @@
+import unittest
+import json
+from unittest import mock
+
+import requests
+
+from catalog import SpacesCatalogCache
+
+CATALOG = [
+    {
+        'id': 1,
+        'name': "Sala Reunión",
+        'subcategories': [
+            {'id': 1, 'name': "Pequeña", 'spaces': [{'id': 15}]},
+            {'id': 2, 'name': "Mediana", 'spaces': []}
+        ]
+    }
+]
+
+
+def response(status_code, data=None, headers=None):
+    rv = requests.Response()
+    rv.status_code = status_code
+    rv._content = json.dumps(data).encode('utf-8') if data is not None else b''
+    rv.headers.update(headers or {})
+    return rv
+
+
+class SpacesCatalogCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SpacesCatalogCache('http://spaces/api/spaces/create', ttl=60, stale_ttl=60, timeout=1)
+
+    @mock.patch('catalog.requests.get')
+    def test_fresh_entry_is_cached(self, get):
+        get.return_value = response(200, CATALOG, {'ETag': '"v1"'})
+
+        categories = self.cache.get('Bearer token')
+        assert [s['id'] for s in categories[0]['subcategories']] == [1]
+
+        # Mutating a copy doesn't change the cache
+        categories[0]['subcategories'][0]['spaces'][0]['quantity'] = 3
+        categories[0]['subcategories'][0]['observation'] = 16
+
+        categories = self.cache.get('Bearer token')
+        assert 'quantity' not in categories[0]['subcategories'][0]['spaces'][0]
+        assert 'observation' not in categories[0]['subcategories'][0]
+        assert get.call_count == 1
+
+    @mock.patch('catalog.requests.get')
+    def test_revalidation(self, get):
+        get.return_value = response(200, CATALOG, {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jun 2020 00:00:00 GMT'})
+        self.cache.get('Bearer token')
+
+        get.return_value = response(304)
+        entry = self.cache.refresh('Bearer token')
+        headers = get.call_args[1]['headers']
+        assert headers['If-None-Match'] == '"v1"'
+        assert headers['If-Modified-Since'] == 'Mon, 01 Jun 2020 00:00:00 GMT'
+        assert entry.categories[0]['name'] == "Sala Reunión"
+
+    @mock.patch('catalog.requests.get')
+    def test_stale_entry_is_served(self, get):
+        get.return_value = response(200, CATALOG)
+        self.cache.get('Bearer token')
+        self.cache._entry.fetched_at -= 1000
+
+        # Expired beyond the stale window and the spaces module is down
+        get.side_effect = requests.exceptions.ConnectTimeout()
+        categories = self.cache.get('Bearer token')
+        assert categories[0]['name'] == "Sala Reunión"
+
+        self.cache.invalidate()
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.cache.get('Bearer token')
+
+
+if __name__ == '__main__':
+    unittest.main()
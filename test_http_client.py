@@ -0,0 +1,120 @@
+import unittest
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from unittest import mock
+
+import metrics
+from http_client import ServiceClient, outbound_executor, reset_outbound_executor, submit_outbound
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = {}
+
+    def do_GET(self):
+        Handler.hits[self.path] = Handler.hits.get(self.path, 0) + 1
+        if self.path == '/slow':
+            time.sleep(0.5)
+        status = {'/error': 500, '/unavailable': 503}.get(self.path, 200)
+        body = b'{"id": 1}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServiceClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.hits = {}
+        self.client = ServiceClient('test', pool_size=2, connect_timeout=1, read_timeout=0.2,
+                                    retries=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_stats(self):
+        for _ in range(3):
+            rv = self.client.get(self.url + '/ok')
+            self.assertEqual(rv.json(), {'id': 1})
+        self.client.get(self.url + '/error')
+
+        stats = self.client.stats()
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual(stats['errors'], 1)
+        self.assertGreater(stats['max_time'], 0)
+        self.assertIn(['test'], [labels for labels, _ in metrics.OUTBOUND_ERRORS.snapshot()])
+
+    def test_timeout(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.client.get(self.url + '/slow')
+        self.assertEqual(self.client.stats()['errors'], 1)
+
+    def test_retries(self):
+        rv = self.client.get(self.url + '/unavailable')
+        self.assertEqual(rv.status_code, 503)
+        self.assertEqual(Handler.hits['/unavailable'], 3)
+
+    def test_sessions_per_thread_share_the_pool(self):
+        sessions = []
+
+        def call():
+            self.client.get(self.url + '/ok')
+            sessions.append(self.client.session)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(session) for session in sessions}), 3)
+        self.assertTrue(all(session.adapters['http://'] is self.client.adapter for session in sessions))
+        self.assertEqual(self.client.stats()['count'], 3)
+
+    def test_fork_gets_a_new_pool(self):
+        adapter = self.client.adapter
+        session = self.client.session
+        with mock.patch('http_client.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(self.client.adapter, adapter)
+            self.assertIsNot(self.client.session, session)
+
+        self.client.reset()
+        self.assertIsNot(self.client.adapter, adapter)
+
+        executor = outbound_executor()
+        reset_outbound_executor()
+        self.assertIsNot(outbound_executor(), executor)
+
+    def test_upstream_time_of_the_request(self):
+        metrics.start_request()
+        submit_outbound(self.client.get, self.url + '/ok').result()
+        self.client.get(self.url + '/ok')
+        timings = metrics.current_timings()
+        self.assertEqual(timings.upstream_calls, 2)
+        self.assertGreater(timings.upstream_time, 0)
+        metrics.finish_request('/test', 'GET', 200, 0.01)
+        self.assertIsNone(metrics.current_timings())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import datetime
+import importlib
+import json
+import sys
+from unittest import mock
+
+import json_provider
+from lib import app
+
+DATA = {
+    'b': 1.5,
+    'a': [1, 2, {'z': None, 'y': "Sala Reunión"}],
+    'workspaces': [{'id': i, 'name': f"Category {i}", 'subcategories': [{'id': i, 'spaces': []}]} for i in range(50)]
+}
+
+
+class JsonProviderTest(unittest.TestCase):
+    def test_dumps_sorts_keys(self):
+        with app.app_context():
+            encoded = json_provider.dumps(DATA)
+            assert json.loads(encoded) == DATA
+            assert encoded == json.dumps(DATA, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+            assert json_provider.loads(json_provider.dumps({'date': datetime.date(2020, 6, 1)})) == \
+                {'date': 'Mon, 01 Jun 2020 00:00:00 GMT'}
+
+    def test_stdlib_fallback(self):
+        try:
+            with mock.patch.dict(sys.modules, {'orjson': None}):
+                fallback = importlib.reload(json_provider)
+            assert fallback.orjson is None
+            with app.app_context():
+                assert json.loads(fallback.dumps(DATA)) == DATA
+        finally:
+            importlib.reload(json_provider)
+
+    def test_dumps_with_raw_field(self):
+        with app.app_context():
+            raw = json_provider.dumps({'id': 5})
+            assert json.loads(json_provider.dumps_with_raw_field({'id': 3, 'm2': 1}, 'm2', raw)) == \
+                {'id': 3, 'm2': {'id': 5}}
+            assert json.loads(json_provider.dumps_with_raw_field({}, 'm2', raw)) == {'m2': {'id': 5}}
+
+    def test_iter_json(self):
+        with app.app_context():
+            chunks = list(json_provider.iter_json(DATA, 'workspaces', chunk_size=256))
+            assert len(chunks) > 1
+            assert json.loads(b''.join(chunks)) == DATA
+            assert json.loads(b''.join(json_provider.iter_json({'workspaces': []}, 'workspaces'))) == {'workspaces': []}
+
+    def test_json_response(self):
+        with app.app_context():
+            rv = json_provider.json_response({'area': 516.5}, 201)
+            assert rv.status_code == 201
+            assert rv.mimetype == 'application/json'
+            assert json.loads(rv.data) == {'area': 516.5}
+
+
+if __name__ == '__main__':
+    unittest.main()
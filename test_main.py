@@ -1,9 +1,15 @@
 import unittest
 import os
+import shutil
+import tempfile
+import time
 import json
 import jwt
-from main import app, db
+import constants
+from unittest import mock
+from main import app, create_app, db, m2_response_cache, reset_after_fork, projects_client, M2Generated, M2GeneratedWorkspace, load_m2_generated_data
 from lib import load_config_vars
+from auth import token_verifier, PublicKey, PublicKeyUnavailable
 
 class MainTest(unittest.TestCase):
     def setUp(self):
@@ -13,6 +19,7 @@ class MainTest(unittest.TestCase):
                                                 os.path.join('.', 'test.db')
         db.create_all()
         load_config_vars()
+        m2_response_cache.clear()
         f = open('oauth-private.key', 'r')
         self.key = f.read()
         f.close()
@@ -28,7 +35,7 @@ class MainTest(unittest.TestCase):
             "jti": "450ca670aff83b220d8fd58d9584365614fceaf210c8db2cf4754864318b5a398cf625071993680d",
             "iat": 1592309117,
             "nbf": 1592309117,
-            "exp": 1624225038,
+            "exp": int(time.time()) + 3600,
             "sub": "23",
             "user_id": user_id,
             "scopes": [],
@@ -43,6 +50,44 @@ class MainTest(unittest.TestCase):
             rv = client.post('/api/m2', data = json.dumps(sent), content_type='application/json')
             self.assertEqual(rv.status_code, 200)
 
+    def test_get_m2_breakdown(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            sent = {'hotdesking_level': 75, 'collaboration_level': 40, 'num_of_workers': 100}
+            rv = client.post('/api/m2/breakdown', data = json.dumps(sent), content_type='application/json')
+            self.assertEqual(rv.status_code, 200)
+            breakdown = json.loads(rv.data)
+            area = json.loads(client.post('/api/m2', data = json.dumps(sent), content_type='application/json').data)['area']
+            self.assertAlmostEqual(breakdown['total'], area)
+            self.assertEqual(set(breakdown.keys()), {'open_plan', 'private_office', 'phonebooth', 'formal_collaborative',
+                                                     'informal_collaborative', 'support', 'circulations', 'total',
+                                                     'config_version'})
+            self.assertEqual(breakdown['config_version'], 1)
+
+    def test_get_m2_values_batch(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            scenarios = [{'hotdesking_level': 75, 'collaboration_level': 40, 'num_of_workers': 100},
+                         {'hotdesking_level': 90, 'collaboration_level': 32, 'num_of_workers': 540}]
+            rv = client.post('/api/m2/batch', data = json.dumps({'scenarios': scenarios}), content_type='application/json')
+            self.assertEqual(rv.status_code, 200)
+            areas = json.loads(rv.data)['areas']
+            for scenario, area in zip(scenarios, areas):
+                rv = client.post('/api/m2', data = json.dumps(scenario), content_type='application/json')
+                self.assertEqual(json.loads(rv.data)['area'], area)
+
+            rv = client.post('/api/m2/batch', data = json.dumps({'scenarios': [{'hotdesking_level': 75}]}), content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+
+            for value in (None, "75", [75, 80], True, {'level': 75}):
+                body = {'scenarios': [dict(scenarios[0], hotdesking_level=value)]}
+                rv = client.post('/api/m2/batch', data = json.dumps(body), content_type='application/json')
+                self.assertEqual(rv.status_code, 400, value)
+
+            with mock.patch('main.M2_BATCH_MAX_SCENARIOS', 1):
+                rv = client.post('/api/m2/batch', data = json.dumps({'scenarios': scenarios}), content_type='application/json')
+                self.assertEqual(rv.status_code, 400)
+
     def test_get_generate_workspaces(self):
         with app.test_client() as client:
             client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
@@ -50,6 +95,224 @@ class MainTest(unittest.TestCase):
             rv = client.post('/api/m2/generate', data = json.dumps(sent), content_type='application/json')
             self.assertEqual(rv.status_code, 200)
 
+    @mock.patch('main.spaces_catalog')
+    def test_generate_workspaces_streams_catalog(self, spaces_catalog):
+        spaces_catalog.get.return_value = [{
+            'id': 1,
+            'name': "Sala Reunión",
+            'subcategories': [
+                {'id': 1, 'name': "Pequeña", 'people_capacity': 5.0, 'usage_percentage': 0.45,
+                 'spaces': [{'id': 15}, {'id': 18}]},
+                {'id': 2, 'name': "Mediana", 'people_capacity': 8.0, 'usage_percentage': 0.35,
+                 'spaces': [{'id': 16}]}
+            ]
+        }]
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            sent = {'hotdesking_level': 75, 'collaboration_level': 40, 'num_of_workers': 100, 'area': 516.5305429864253}
+            rv = client.post('/api/m2/generate', data = json.dumps(sent), content_type='application/json')
+            self.assertEqual(rv.status_code, 200)
+            self.assertTrue(rv.is_streamed)
+            data = json.loads(rv.data)
+            self.assertEqual(data['num_of_workers'], 100)
+            subcategories = data['workspaces'][0]['subcategories']
+            self.assertEqual([space['quantity'] for space in subcategories[0]['spaces']], [3, 0])
+            self.assertEqual(subcategories[0]['observation'], 16)
+
+    def test_reset_after_fork(self):
+        self.assertEqual(M2Generated.query.count(), 0)
+        adapter = projects_client.adapter
+        reset_after_fork()
+        self.assertIsNot(projects_client.adapter, adapter)
+        self.assertEqual(M2Generated.query.count(), 0)
+
+    def test_get_stats(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rv = client.get('/api/m2/stats')
+            self.assertEqual(rv.status_code, 200)
+            stats = json.loads(rv.data)
+            self.assertEqual(stats['pid'], os.getpid())
+            self.assertEqual(set(stats['http'].keys()), {'projects', 'spaces'})
+            self.assertIn('hits', stats['m2_response_cache'])
+            self.assertIn('db_pool', stats)
+
+    def test_get_metrics(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            sent = {'hotdesking_level': 75, 'collaboration_level': 40, 'num_of_workers': 100}
+            client.post('/api/m2/breakdown', data = json.dumps(sent), content_type='application/json')
+            client.get('/api/m2/constants')
+            rv = client.get('/api/m2/metrics')
+            self.assertEqual(rv.status_code, 200)
+            text = rv.data.decode('utf-8')
+            self.assertIn('m2_http_request_duration_seconds_count{route="/api/m2/breakdown",method="POST"}', text)
+            self.assertIn('m2_http_requests_total{route="/api/m2/constants",method="GET",status="200"}', text)
+            self.assertIn('m2_db_statements_per_request_count{route="/api/m2/constants"}', text)
+            self.assertIn('# TYPE m2_outbound_request_duration_seconds histogram', text)
+            statements = [line for line in text.splitlines()
+                          if line.startswith('m2_db_statements_total ')]
+            self.assertGreater(float(statements[0].split()[1]), 0)
+
+    def test_missing_public_key(self):
+        with app.test_client() as client, \
+                mock.patch.object(token_verifier, 'public_key', PublicKey('/nonexistent/oauth-public.key')):
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rv = client.get('/api/m2/constants')
+            self.assertEqual(rv.status_code, 500)
+            self.assertNotIn('nonexistent', rv.data.decode('utf-8'))
+            with self.assertRaises(PublicKeyUnavailable):
+                create_app()
+
+    @mock.patch('profiling.PROFILING_ADMIN_USER_IDS', frozenset({1}))
+    @mock.patch('profiling.PROFILING_ENABLED', True)
+    def test_timing_headers(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rv = client.get('/api/m2/constants')
+            self.assertGreater(int(rv.headers['X-Query-Count']), 0)
+            self.assertGreaterEqual(float(rv.headers['X-DB-Time']), 0)
+            self.assertEqual(float(rv.headers['X-Upstream-Time']), 0)
+
+            # Not for other users nor for requests without a valid token
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key, user_id=2)
+            rv = client.get('/api/m2/constants')
+            self.assertEqual(rv.status_code, 200)
+            self.assertNotIn('X-Query-Count', rv.headers)
+            client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer invalid'
+            rv = client.get('/api/m2/constants')
+            self.assertNotIn('X-Query-Count', rv.headers)
+
+    @mock.patch('profiling.PROFILING_ADMIN_USER_IDS', frozenset({1}))
+    @mock.patch('profiling.PROFILING_ENABLED', True)
+    def test_profiled_request(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with app.test_client() as client, mock.patch('profiling.PROFILING_DIR', directory):
+                client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+                rv = client.get('/api/m2/constants', headers={'X-Profile': 'store'})
+                self.assertEqual(rv.status_code, 200)
+                self.assertIn(rv.headers['X-Profile-Id'], os.listdir(directory))
+                self.assertIsInstance(json.loads(rv.data), list)
+
+                rv = client.get('/api/m2/constants', headers={'X-Profile': 'text'})
+                self.assertEqual(rv.mimetype, 'text/plain')
+                self.assertIn('function calls', rv.data.decode('utf-8'))
+
+                # Not for other users
+                client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key, user_id=2)
+                rv = client.get('/api/m2/constants', headers={'X-Profile': 'store'})
+                self.assertNotIn('X-Profile-Id', rv.headers)
+        finally:
+            shutil.rmtree(directory)
+
+    @staticmethod
+    def save_body(project_id=3, quantities=(3, 2)):
+        return {
+            'project_id': project_id,
+            'area': 516.5305429864253,
+            'collaboration_level': 40,
+            'hotdesking_level': 75,
+            'num_of_workers': 100,
+            'workspaces': [{
+                'id': 1,
+                'name': "Sala Reunión",
+                'subcategories': [
+                    {'id': 1, 'name': "Pequeña", 'observation': 16, 'spaces': [{'id': 15, 'quantity': quantities[0]}]},
+                    {'id': 2, 'name': "Mediana", 'observation': 12, 'spaces': [{'id': 16, 'quantity': quantities[1]}]}
+                ]
+            }]
+        }
+
+    @mock.patch('main.update_project_by_id')
+    @mock.patch('main.get_project_by_id')
+    def test_save_and_get_workspaces(self, get_project, update_project):
+        get_project.side_effect = lambda project_id, token: {'id': int(project_id), 'name': "TEST"}
+        update_project.side_effect = lambda project_id, data, token: dict({'id': project_id, 'name': "TEST"}, **data)
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rv = client.post('/api/m2/save', data = json.dumps(self.save_body()), content_type='application/json')
+            self.assertEqual(rv.status_code, 201)
+            saved = json.loads(rv.data)['m2_generated_data']
+            self.assertEqual(saved['density'], 5.165305429864253)
+            self.assertEqual(saved['config_version'], 1)
+            self.assertEqual(sorted((w['space_id'], w['quantity'], w['observation']) for w in saved['workspaces']),
+                             [(15, 3, 16), (16, 2, 12)])
+
+            rv = client.get('/api/m2/3')
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(json.loads(rv.data)['m2_generated_data'], saved)
+
+            rv = client.get('/api/m2/4')
+            self.assertEqual(rv.status_code, 404)
+
+    def test_load_m2_generated_data(self):
+        m2_gen = M2Generated(hot_desking_level=75, collaboration_level=40, workers_number=100,
+                             area=516.5, density=5.165, project_id=7)
+        db.session.add(m2_gen)
+        db.session.commit()
+        self.assertEqual(load_m2_generated_data(7), m2_gen.to_dict())
+        self.assertEqual(load_m2_generated_data(7)['workspaces'], [])
+
+        m2_gen.workspaces = [M2GeneratedWorkspace(space_id=15, quantity=3, observation=16),
+                             M2GeneratedWorkspace(space_id=16, quantity=2)]
+        db.session.commit()
+        self.assertEqual(load_m2_generated_data(7), m2_gen.to_dict())
+        self.assertIsNone(load_m2_generated_data(8))
+
+    @mock.patch('main.update_project_by_id')
+    @mock.patch('main.get_project_by_id')
+    def test_resave_workspaces(self, get_project, update_project):
+        get_project.side_effect = lambda project_id, token: {'id': int(project_id), 'name': "TEST"}
+        update_project.side_effect = lambda project_id, data, token: dict({'id': project_id, 'name': "TEST"}, **data)
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rv = client.post('/api/m2/save', data = json.dumps(self.save_body()), content_type='application/json')
+            first = json.loads(rv.data)['m2_generated_data']
+            hits = m2_response_cache.stats()['hits']
+            for _ in range(2):
+                rv = client.get('/api/m2/3')
+                self.assertEqual(json.loads(rv.data)['m2_generated_data'], first)
+            self.assertEqual(m2_response_cache.stats()['hits'], hits + 1)
+
+            body = self.save_body(quantities=(5, 2))
+            body['workspaces'][0]['subcategories'][1]['spaces'] = [{'id': 17, 'quantity': 1}]
+            rv = client.post('/api/m2/save', data = json.dumps(body), content_type='application/json')
+            self.assertEqual(rv.status_code, 201)
+            second = json.loads(rv.data)['m2_generated_data']
+
+            self.assertEqual(second['id'], first['id'])
+            self.assertEqual(json.loads(rv.data)['m2_gen_id'], first['id'])
+            self.assertEqual(sorted((w['space_id'], w['quantity']) for w in second['workspaces']), [(15, 5), (17, 1)])
+            space_15 = next(w['id'] for w in first['workspaces'] if w['space_id'] == 15)
+            self.assertIn(space_15, [w['id'] for w in second['workspaces']])
+            self.assertEqual(json.loads(rv.data)['m2_changes'], {'inserted': [17], 'updated': [15], 'deleted': [16]})
+            rv = client.get('/api/m2/3')
+            self.assertEqual(json.loads(rv.data), {'id': 3, 'name': "TEST", 'm2_generated_data': second})
+
+            rv = client.post('/api/m2/save', data = json.dumps(body), content_type='application/json')
+            self.assertEqual(json.loads(rv.data)['m2_changes'], {'inserted': [], 'updated': [], 'deleted': []})
+            self.assertEqual(json.loads(rv.data)['m2_generated_data']['workspaces'], second['workspaces'])
+
+            # A save handled by another worker doesn't invalidate this worker's cache, but it bumps the revision
+            client.get('/api/m2/3')
+            M2Generated.query.filter_by(project_id=3).update({'area': 600.0, 'revision': M2Generated.revision + 1})
+            db.session.commit()
+            rv = client.get('/api/m2/3')
+            self.assertEqual(json.loads(rv.data)['m2_generated_data']['area'], 600.0)
+
+    @mock.patch('main.get_project_by_id', return_value=None)
+    def test_save_workspaces_without_project(self, get_project):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            body = self.save_body()
+            del body['workspaces']
+            rv = client.post('/api/m2/save', data = json.dumps(body), content_type='application/json')
+            self.assertEqual(rv.status_code, 404)
+
+            rv = client.get('/api/m2/3')
+            self.assertEqual(rv.status_code, 404)
+
     def test_get_all_constants(self):
         with app.test_client() as client:
             client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
@@ -69,5 +332,81 @@ class MainTest(unittest.TestCase):
             self.assertEqual(next((True for constant in constants if constant['value'] == sent[0]['value'] and constant['id'] == sent[0]['id']), False), True)
             self.assertEqual(next((True for constant in constants if constant['value'] == sent[1]['value'] and constant['id'] == sent[1]['id']), False), True)
 
+    def test_constants_versions(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            sent = {'hotdesking_level': 75, 'collaboration_level': 40, 'num_of_workers': 100}
+            rv = client.post('/api/m2', data = json.dumps(sent), content_type='application/json')
+            self.assertEqual(json.loads(rv.data)['config_version'], 1)
+            old_area = json.loads(rv.data)['area']
+            old_constants = json.loads(client.get('/api/m2/constants').data)
+
+            open_plan = next(c for c in old_constants if c['name'] == constants.DEN_PUESTO_TRABAJO_OPEN)
+            rv = client.put('/api/m2/constants', data = json.dumps([{'id': open_plan['id'], 'value': 4.0}]),
+                            content_type='application/json')
+            self.assertEqual(rv.status_code, 200)
+            rv = client.get('/api/m2/constants/versions')
+            self.assertEqual(json.loads(rv.data), {'current': 2, 'versions': [1, 2]})
+
+            rv = client.post('/api/m2', data = json.dumps(sent), content_type='application/json')
+            self.assertEqual(json.loads(rv.data)['config_version'], 2)
+            self.assertNotEqual(json.loads(rv.data)['area'], old_area)
+            rv = client.post('/api/m2', data = json.dumps(dict(sent, config_version=1)), content_type='application/json')
+            self.assertEqual(json.loads(rv.data), {'area': old_area, 'config_version': 1})
+            rv = client.post('/api/m2', data = json.dumps(dict(sent, config_version=99)), content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+
+            rv = client.post('/api/m2/breakdown', data = json.dumps(dict(sent, config_version=1)), content_type='application/json')
+            self.assertAlmostEqual(json.loads(rv.data)['total'], old_area)
+            self.assertEqual(json.loads(rv.data)['config_version'], 1)
+            rv = client.post('/api/m2/breakdown', data = json.dumps(dict(sent, config_version=99)), content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+            rv = client.post('/api/m2/batch', data = json.dumps({'scenarios': [sent], 'config_version': 1}),
+                             content_type='application/json')
+            self.assertEqual(json.loads(rv.data), {'areas': [old_area], 'config_version': 1})
+            rv = client.post('/api/m2/batch', data = json.dumps({'scenarios': [sent], 'config_version': 99}),
+                             content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+
+            rv = client.get('/api/m2/constants?version=1')
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(json.loads(rv.data), [dict(c, version=1) for c in old_constants])
+            rv = client.get('/api/m2/constants?version=99')
+            self.assertEqual(rv.status_code, 404)
+
+    def test_get_all_rules(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rv = client.get('/api/m2/rules')
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(len(json.loads(rv.data)), len(constants.GLOBAL_QUANTITY_RULES))
+
+    def test_update_rules(self):
+        with app.test_client() as client:
+            client.environ_base['HTTP_AUTHORIZATION'] = self.build_token(self.key)
+            rules = json.loads(client.get('/api/m2/rules').data)
+            bathroom = next(rule for rule in rules if rule['subcategory'] == "Baños" and rule['upper'] == 11)
+
+            sent = [{'id': bathroom['id'], 'value': 2.0}]
+            rv = client.put('/api/m2/rules', data = json.dumps(sent), content_type='application/json')
+            self.assertEqual(rv.status_code, 200)
+            updated = next(rule for rule in json.loads(rv.data) if rule['id'] == bathroom['id'])
+            self.assertEqual(updated['value'], 2.0)
+
+            # Overlaps the band [11, 31)
+            sent = [{'id': bathroom['id'], 'upper': 20}]
+            rv = client.put('/api/m2/rules', data = json.dumps(sent), content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+
+            for field, value in (('variable', 'salary'), ('target', 'price')):
+                sent = [{'id': bathroom['id'], field: value}]
+                rv = client.put('/api/m2/rules', data = json.dumps(sent), content_type='application/json')
+                self.assertEqual(rv.status_code, 400, field)
+            rules = json.loads(client.get('/api/m2/rules').data)
+            stored = next(rule for rule in rules if rule['id'] == bathroom['id'])
+            self.assertEqual(stored['variable'], bathroom['variable'])
+            self.assertEqual(stored['target'], bathroom['target'])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,133 @@
+import unittest
+import json
+import os
+import shutil
+import time
+import tempfile
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import metrics
+from metrics import Registry, clear_directory
+
+
+def build_registry(directory=''):
+    registry = Registry(directory, flush_interval=0)
+    requests = registry.counter('requests_total', "Requests.", ('route',))
+    latency = registry.histogram('latency_seconds', "Latency.", ('route',), buckets=(0.1, 1.0))
+    return registry, requests, latency
+
+
+class RegistryTest(unittest.TestCase):
+    def test_render(self):
+        registry, requests, latency = build_registry()
+        requests.inc(('/api/m2',))
+        requests.inc(('/api/m2',))
+        latency.observe(0.05, ('/api/m2',))
+        latency.observe(0.5, ('/api/m2',))
+        latency.observe(2, ('/api/m2',))
+
+        text = registry.render()
+        assert '# TYPE requests_total counter' in text
+        assert 'requests_total{route="/api/m2"} 2' in text
+        assert '# TYPE latency_seconds histogram' in text
+        assert 'latency_seconds_bucket{route="/api/m2",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{route="/api/m2",le="1"} 2' in text
+        assert 'latency_seconds_bucket{route="/api/m2",le="+Inf"} 3' in text
+        assert 'latency_seconds_sum{route="/api/m2"} 2.55' in text
+        assert 'latency_seconds_count{route="/api/m2"} 3' in text
+
+    def test_aggregation_across_processes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            worker_1, requests_1, latency_1 = build_registry(directory)
+            worker_2, requests_2, latency_2 = build_registry(directory)
+            with mock.patch('metrics.os.getpid', return_value=101):
+                requests_1.inc(('/api/m2',))
+                latency_1.observe(0.05, ('/api/m2',))
+                worker_1.flush()
+            with mock.patch('metrics.os.getpid', return_value=102):
+                requests_2.inc(('/api/m2',))
+                requests_2.inc(('/api/m2/save',))
+                latency_2.observe(0.5, ('/api/m2',))
+                text = worker_2.render()
+
+            assert 'requests_total{route="/api/m2"} 2' in text
+            assert 'requests_total{route="/api/m2/save"} 1' in text
+            assert 'latency_seconds_count{route="/api/m2"} 2' in text
+            assert 'latency_seconds_bucket{route="/api/m2",le="0.1"} 1' in text
+
+            clear_directory(directory)
+            assert 'requests_total{route="/api/m2/save"} 1' not in worker_1.render()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_retired_workers_are_folded(self):
+        directory = tempfile.mkdtemp()
+        try:
+            master, _, _ = build_registry(directory)
+            scraper, _, _ = build_registry(directory)
+            for pid in (101, 102):
+                worker, requests, latency = build_registry(directory)
+                with mock.patch('metrics.os.getpid', return_value=pid):
+                    requests.inc(('/api/m2',))
+                    latency.observe(0.05, ('/api/m2',))
+                    worker.flush()
+                master.retire(pid)
+
+            assert sorted(os.listdir(directory)) == ['.lock', 'exited.json']
+            text = scraper.render()
+            assert 'requests_total{route="/api/m2"} 2' in text
+            assert 'latency_seconds_count{route="/api/m2"} 2' in text
+
+            # A new worker with a reused PID starts from its own empty file
+            worker, requests, _ = build_registry(directory)
+            with mock.patch('metrics.os.getpid', return_value=101):
+                requests.inc(('/api/m2',))
+                worker.flush()
+            assert 'requests_total{route="/api/m2"} 3' in scraper.render()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_background_flush(self):
+        directory = tempfile.mkdtemp()
+        registry, requests, _ = build_registry(directory)
+        registry.flush_interval = 0.01
+        try:
+            requests.inc(('/api/m2',))
+            registry.maybe_flush()
+            path = os.path.join(directory, f"{os.getpid()}.json")
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            with open(path) as f:
+                assert json.load(f)['requests_total'] == [[['/api/m2'], 1.0]]
+        finally:
+            registry.reset()
+            shutil.rmtree(directory)
+
+class SQLMetricsTest(unittest.TestCase):
+    def test_failed_statements(self):
+        metrics.init_app(Flask(__name__))
+        engine = create_engine('sqlite://')
+        metrics.start_request()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                for _ in range(3):
+                    with self.assertRaises(OperationalError):
+                        conn.execute(text("SELECT * FROM missing_table"))
+                conn.execute(text("SELECT 2"))
+                assert 'm2_query_start' not in conn.info
+            assert metrics.current_timings().statements == 5
+        finally:
+            metrics.finish_request('test', 'GET', 200, 0.0)
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
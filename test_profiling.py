@@ -0,0 +1,51 @@
+import unittest
+import os
+import pstats
+import shutil
+import tempfile
+
+import profiling
+from profiling import requested_profile_mode, run_profiled, save_profile, profile_report
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+class ProfilingTest(unittest.TestCase):
+    def test_requested_profile_mode(self):
+        admins = frozenset({1})
+        assert requested_profile_mode('store', 1, True, admins) == 'store'
+        assert requested_profile_mode('1', 1, True, admins) == 'store'
+        assert requested_profile_mode('TEXT', 1, True, admins) == 'text'
+        assert requested_profile_mode('other', 1, True, admins) is None
+        assert requested_profile_mode(None, 1, True, admins) is None
+        # Only admins, and only when it's enabled
+        assert requested_profile_mode('store', 2, True, admins) is None
+        assert requested_profile_mode('store', 1, False, admins) is None
+
+    def test_run_profiled(self):
+        result, profile = run_profiled(work, 1000)
+        assert result == work(1000)
+        assert 'work' in profile_report(profile)
+
+        # A second request while one is being profiled isn't profiled
+        with profiling._profile_lock:
+            result, profile = run_profiled(work, 10)
+        assert result == work(10)
+        assert profile is None
+
+    def test_save_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            _, profile = run_profiled(work, 1000)
+            name = save_profile(profile, '/api/m2/<project_id>', directory)
+            assert name.endswith('-api-m2-project-id.prof')
+            stats = pstats.Stats(os.path.join(directory, name))
+            assert stats.total_calls > 0
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
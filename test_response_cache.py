@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ResponseCache()
+        assert cache.get('3') is None
+        assert cache.set('3', b'{"id": 1}')
+        assert cache.get('3') == b'{"id": 1}'
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 1, 'bytes': 9}
+
+        cache.invalidate('3')
+        assert cache.get('3') is None
+        assert cache.stats()['bytes'] == 0
+
+    def test_lru_eviction_by_entries_and_bytes(self):
+        cache = ResponseCache(max_entries=2, max_bytes=10)
+        cache.set('1', b'aaaa')
+        cache.set('2', b'bbbb')
+        cache.get('1')
+        cache.set('3', b'cccc')
+        assert cache.get('2') is None
+        assert cache.get('1') == b'aaaa'
+
+        cache.set('4', b'dddddddd')
+        assert cache.stats()['entries'] == 1
+        assert cache.get('4') == b'dddddddd'
+
+        assert not cache.set('5', b'x' * 11)
+        assert cache.get('5') is None
+
+    @mock.patch('response_cache.time.monotonic')
+    def test_ttl(self, monotonic):
+        cache = ResponseCache(ttl=30)
+        monotonic.return_value = 100.0
+        cache.set('3', b'{}')
+        monotonic.return_value = 129.0
+        assert cache.get('3') == b'{}'
+        monotonic.return_value = 130.0
+        assert cache.get('3') is None
+        assert cache.stats()['entries'] == 0
+
+    def test_value_loaded_before_invalidation_is_not_cached(self):
+        cache = ResponseCache()
+        generation = cache.generation()
+        cache.invalidate('3')
+        assert not cache.set('3', b'{"stale": true}', generation)
+        assert cache.get('3') is None
+        assert cache.set('3', b'{}', cache.generation())
+
+    def test_entry_is_stale_with_another_validator(self):
+        cache = ResponseCache()
+        cache.set('3', b'{"revision": 1}', validator=1)
+        assert cache.get('3', 1) == b'{"revision": 1}'
+        assert cache.get('3', 2) is None
+        assert cache.get('3') is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import os
+
+import constants
+from lib import app, db, load_config_vars, quantity_intermediates, reload_config, bump_config_revision, M2QuantityRule
+from rules import RuleContext, CompiledRule, evaluate_rules
+
+
+class RulesTest(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+                                                os.path.join('.', 'test.db')
+        db.create_all()
+        load_config_vars()
+        self.loads = 0
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def loader(self, hotdesking, grade_of_collaboration, workers_number):
+        self.loads += 1
+        return quantity_intermediates(hotdesking, grade_of_collaboration, workers_number)
+
+    def test_intermediates_are_lazy(self):
+        ctx = RuleContext(75, 40, 100, 516.53, loader=self.loader)
+        assert evaluate_rules("Area Servicios", {'name': "Baños"}, ctx) == (6, None)
+        assert evaluate_rules("Especiales", {'name': "Sala Capacitación"}, ctx) == (0, None)
+        assert self.loads == 0
+
+        evaluate_rules("Puestos Trabajo", {'name': "Open Plan"}, ctx)
+        evaluate_rules("Area Soporte", {'name': "Phonebooth"}, ctx)
+        evaluate_rules("Sala Reunión", {'name': "Pequeña", 'usage_percentage': 0.45, 'people_capacity': 5.0}, ctx)
+        assert self.loads == 1
+
+    def test_evaluate_rules(self):
+        ctx = RuleContext(75, 40, 100, 516.53)
+        assert evaluate_rules("Puestos Trabajo", {'name': "Open Plan"}, ctx) == (68, None)
+        assert evaluate_rules("Puestos Trabajo Privado", {'name': "Privado Pequeño"}, ctx) == (3, None)
+        assert evaluate_rules("Area Soporte", {'name': "Recepción Pequeña (más Lounge Pequeño)"}, ctx) == (1, None)
+        assert evaluate_rules("Area Soporte", {'name': "Workcoffee/Comedor Mediano"}, ctx) == (1, None)
+        assert evaluate_rules("Area Soporte Reuniones Informales", {'name': "Grande"}, ctx) == (1, 8)
+        assert evaluate_rules("Sala Reunión", {'name': "Pequeña", 'usage_percentage': 0.45, 'people_capacity': 5.0}, ctx) \
+            == (3, 16)
+        assert evaluate_rules("Area Servicios", {'name': "Print Pequeño"}, ctx) == (2, None)
+
+        with self.assertRaises(KeyError):
+            evaluate_rules("Area Soporte", {'name': "Unknown"}, ctx)
+
+    def test_compiled_rule_bands(self):
+        def band(id, lower=None, upper=None, lower_inclusive=True, upper_inclusive=False, value=1.0):
+            return {'id': id, 'variable': constants.VAR_AREA, 'lower': lower, 'upper': upper,
+                    'lower_inclusive': lower_inclusive, 'upper_inclusive': upper_inclusive,
+                    'value': value, 'factor': 0.0, 'origin': 0.0, 'divisor': 1.0}
+
+        rule = CompiledRule(constants.VAR_AREA, [band(1, upper=500, value=1.0),
+                                                 band(2, lower=501, upper=1500, upper_inclusive=True, value=2.0),
+                                                 band(3, lower=1500, lower_inclusive=False, value=3.0)])
+        assert rule.evaluate(-10) == 1.0
+        assert rule.evaluate(499.9) == 1.0
+        assert rule.evaluate(500) == 0
+        assert rule.evaluate(500.5) == 0
+        assert rule.evaluate(501) == 2.0
+        assert rule.evaluate(1500) == 2.0
+        assert rule.evaluate(1500.1) == 3.0
+
+        with self.assertRaises(ValueError):
+            CompiledRule(constants.VAR_AREA, [band(1, upper=500), band(2, lower=400)])
+        with self.assertRaises(ValueError):
+            CompiledRule(constants.VAR_AREA, [band(1, upper=500, upper_inclusive=True), band(2, lower=500)])
+
+    def test_rules_hot_reload(self):
+        ctx = RuleContext(75, 40, 5, 516.53)
+        assert evaluate_rules("Area Servicios", {'name': "Baños"}, ctx) == (1, None)
+
+        M2QuantityRule.query \
+            .filter_by(category="Area Servicios", subcategory="Baños", upper=11) \
+            .update({'value': 2})
+        bump_config_revision()
+        db.session.commit()
+        reload_config()
+
+        ctx = RuleContext(75, 40, 5, 516.53)
+        assert evaluate_rules("Area Servicios", {'name': "Baños"}, ctx) == (2, None)
+
+
+if __name__ == '__main__':
+    unittest.main()